@@ -0,0 +1,83 @@
+# compares a shuffled mesh against the same mesh after
+# Mesh.optimize_layout(), for file compressibility and load time
+#
+#   python benchmarks/mesh_layout.py [grid size]
+
+import os.path
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy
+
+import carbide.mesh
+
+
+def wavy_grid(n):
+    x, y = numpy.meshgrid(numpy.linspace(0, 1, n), numpy.linspace(0, 1, n))
+    z = 0.05 * numpy.sin(12 * x) * numpy.cos(9 * y)
+    positions = numpy.stack([x, y, z], axis=-1).reshape(-1, 3)
+    i, j = numpy.meshgrid(numpy.arange(n - 1), numpy.arange(n - 1),
+                          indexing='ij')
+    a = (i * n + j).ravel()
+    faces = numpy.stack([a, a + 1, a + n + 1, a + n], axis=-1).ravel()
+    uvs = positions[faces, :2]
+    return carbide.mesh.Mesh.from_corners(positions, None, uvs, faces,
+                                          numpy.full(len(faces) // 4, 4))
+
+
+def shuffled(mesh, rng):
+    order = rng.permutation(len(mesh.vertices))
+    remap = numpy.empty_like(order)
+    remap[order] = numpy.arange(len(order))
+    triangles = mesh.triangles[rng.permutation(len(mesh.triangles))]
+    triangles['vs'] = remap[triangles['vs']]
+    return carbide.mesh.Mesh(mesh.vertices[order], triangles)
+
+
+def best_of(fn, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def measure(name, mesh, tmp):
+    path = os.path.join(tmp, name + '.wo3')
+    with open(path, 'wb') as f:
+        mesh.dump(f)
+    data = mesh.dumpb()
+
+    def load():
+        with open(path, 'rb') as f:
+            carbide.mesh.Mesh.load(f)
+
+    def load_stats():
+        carbide.mesh.Mesh.open(path).stats()
+
+    start = time.perf_counter()
+    compressed = len(zlib.compress(data, 6))
+    ztime = time.perf_counter() - start
+
+    print('{:>10} {:>8.1f}% {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+        name, 100 * compressed / len(data), ztime, best_of(load),
+        best_of(load_stats)))
+
+
+def main(n=1000):
+    rng = numpy.random.default_rng(0)
+    mesh = shuffled(wavy_grid(n), rng)
+    print('{} vertices, {} triangles'.format(len(mesh.vertices),
+                                             len(mesh.triangles)))
+    print('{:>10} {:>9} {:>10} {:>10} {:>10}'.format(
+        'layout', 'zlib', 'zlib (s)', 'load (s)', 'stats (s)'))
+    with tempfile.TemporaryDirectory(prefix='carbide.') as tmp:
+        measure('shuffled', mesh, tmp)
+        measure('optimized', mesh.optimize_layout(), tmp)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
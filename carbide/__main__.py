@@ -1,6 +1,117 @@
+import argparse
+import concurrent.futures
+import os
+import os.path
+
 import carbide
+import carbide.mesh
+
+LOADERS = {
+    '.obj': carbide.mesh.load_obj,
+    '.ply': carbide.mesh.load_ply,
+}
+
+
+def convert_one(src, dst, compress=False):
+    mesh = LOADERS[os.path.splitext(src)[1].lower()](src)
+    with open(dst, 'wb') as f:
+        if compress:
+            mesh.dumpz(f)
+        else:
+            mesh.dump(f)
+    return (len(mesh.vertices), len(mesh.triangles))
+
+
+def find_inputs(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in LOADERS:
+                    yield os.path.join(root, name)
+
+
+def convert(args):
+    jobs = []
+    # every output is known before any work starts, so that two inputs
+    # never write the same file from different processes
+    sources = {}
+    for src in find_inputs(args.paths):
+        if os.path.splitext(src)[1].lower() not in LOADERS:
+            raise SystemExit('do not know how to convert `{}`'.format(src))
+        outdir = args.output or os.path.dirname(src)
+        dst = os.path.join(outdir, os.path.splitext(
+            os.path.basename(src))[0] + '.wo3')
+        key = os.path.normcase(os.path.abspath(dst))
+        other = sources.setdefault(key, src)
+        if other is src:
+            jobs.append((src, dst))
+        elif os.path.abspath(other) != os.path.abspath(src):
+            raise SystemExit('`{}` and `{}` would both be written to '
+                             '`{}`'.format(other, src, dst))
+        # otherwise the same input was found twice
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    # parsing is mostly python, so use processes rather than threads
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        futures = {pool.submit(convert_one, src, dst, args.compress): dst
+                   for src, dst in jobs}
+        for fut in concurrent.futures.as_completed(futures):
+            verts, tris = fut.result()
+            print('wrote', futures[fut], '-', verts, 'verts,', tris, 'tris')
+
+
+def pack(args):
+    with carbide.mesh.MeshArchiveWriter(args.archive) as w:
+        for path in args.paths:
+            w.add_file(os.path.basename(path), path)
+
+
+def unpack(args):
+    archive = carbide.mesh.MeshArchive(args.archive)
+    for path in archive.extract_all(args.output):
+        print('wrote', path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m carbide')
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser('convert', help='convert OBJ and PLY to .wo3')
+    p.add_argument('paths', nargs='+',
+                   help='files, or directories to search for them')
+    p.add_argument('-o', '--output',
+                   help='output directory (default: next to each input)')
+    p.add_argument('-j', '--jobs', type=int, default=None,
+                   help='number of parallel conversions')
+    p.add_argument('-z', '--compress', action='store_true',
+                   help='write compressed .wo3 files')
+    p.set_defaults(func=convert)
+
+    p = commands.add_parser('pack', help='pack .wo3 files into an archive')
+    p.add_argument('archive', help='archive to write')
+    p.add_argument('paths', nargs='+', help='.wo3 files to pack')
+    p.set_defaults(func=pack)
+
+    p = commands.add_parser('unpack',
+                            help='unpack an archive into .wo3 files')
+    p.add_argument('archive', help='archive to read')
+    p.add_argument('-o', '--output', default='.',
+                   help='output directory (default: current directory)')
+    p.set_defaults(func=unpack)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        # with no command, check that the blender addon (un)registers
+        carbide.register()
+        carbide.unregister()
+        return
+    args.func(args)
 
-carbide.register()
-carbide.unregister()
 
-import carbide.scene
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,415 @@
+import os
+import os.path
+import zipfile
+
+import numpy
+
+import carbide.mesh
+from carbide.scene.primitive import primitive_bounds
+
+# split candidates per node, and cost of a box test relative to an item
+BINS = 16
+TRAVERSAL_COST = 1.0
+LEAF_SIZE = 4
+# rays traced at once, which bounds the size of the traversal frontier
+RAY_BATCH = 1 << 16
+
+
+def half_area(lo, hi):
+    d = numpy.maximum(hi - lo, 0)
+    return d[..., 0] * d[..., 1] + d[..., 1] * d[..., 2] + \
+        d[..., 2] * d[..., 0]
+
+
+def build(lo, hi, leaf_size=LEAF_SIZE, bins=BINS):
+    # binned SAH build over item boxes. every node at one depth is
+    # split at once, so the work is a few numpy passes per level.
+    # returns (node lo, node hi, node start, node count, item order).
+    # leaves have count > 0 and cover order[start:start + count],
+    # inner nodes have count == 0 and children start and start + 1.
+    # reduceat needs non-empty segments, which every node has.
+    n = len(lo)
+    order = numpy.empty(n, dtype=numpy.int64)
+    # the items of the nodes at this depth, grouped by node, and their
+    # boxes in the same order. take is much faster than fancy indexing
+    # for gathering these.
+    ids = numpy.arange(n, dtype=numpy.int64)
+    alo = numpy.asarray(lo, dtype=numpy.float32)
+    ahi = numpy.asarray(hi, dtype=numpy.float32)
+
+    node_lo, node_hi, node_start, node_count = [], [], [], []
+    level_start = numpy.zeros(1 if n else 0, dtype=numpy.int64)
+    level_count = numpy.full(len(level_start), n, dtype=numpy.int64)
+    total = 0
+    while len(level_start):
+        nodes = len(level_start)
+        rel = numpy.cumsum(level_count) - level_count
+        node_lo.append(numpy.minimum.reduceat(alo, rel))
+        node_hi.append(numpy.maximum.reduceat(ahi, rel))
+        split = numpy.zeros(nodes, dtype=bool)
+        left = numpy.zeros(nodes, dtype=numpy.int64)
+
+        # small nodes are leaves, and put their items in place
+        small = level_count <= leaf_size
+        if small.any():
+            keep = numpy.repeat(~small, level_count)
+            pos = numpy.repeat(level_start - rel, level_count) + \
+                numpy.arange(len(ids))
+            order[pos[~keep]] = ids[~keep]
+            ids, alo, ahi = ids[keep], alo[keep], ahi[keep]
+        cand = numpy.flatnonzero(~small)
+        count = level_count[cand]
+        seg = numpy.repeat(numpy.arange(len(cand)), count)
+        rel = numpy.cumsum(count) - count
+
+        # bin along each node's widest centroid axis. sorting by bin
+        # within each node leaves every split point contiguous
+        ac = (alo + ahi) / 2
+        clo = numpy.minimum.reduceat(ac, rel) if len(ac) else ac
+        chi = numpy.maximum.reduceat(ac, rel) if len(ac) else ac
+        axis = numpy.argmax(chi - clo, axis=1)
+        span = numpy.take_along_axis(chi - clo, axis[:, None], 1)[:, 0]
+        lo_axis = numpy.take_along_axis(clo, axis[:, None], 1)[:, 0]
+        scale = bins / numpy.where(span > 0, span, 1)
+        t = (numpy.take_along_axis(ac, axis[seg, None], 1)[:, 0]
+             - lo_axis[seg]) * scale[seg]
+        key = seg * bins + numpy.clip(t.astype(numpy.int64), 0, bins - 1)
+        sort = numpy.argsort(key, kind='stable')
+        key = numpy.take(key, sort)
+        ids, alo, ahi = [numpy.take(a, sort, axis=0) for a in [ids, alo, ahi]]
+        counts = numpy.bincount(key, minlength=len(cand) * bins) \
+                      .reshape(-1, bins)
+        used = numpy.flatnonzero(numpy.diff(key, prepend=-1))
+        bin_lo = numpy.full((len(cand) * bins, 3), numpy.inf,
+                            dtype=numpy.float32)
+        bin_hi = numpy.full((len(cand) * bins, 3), -numpy.inf,
+                            dtype=numpy.float32)
+        if len(used):
+            bin_lo[key[used]] = numpy.minimum.reduceat(alo, used)
+            bin_hi[key[used]] = numpy.maximum.reduceat(ahi, used)
+        bin_lo = bin_lo.reshape(-1, bins, 3)
+        bin_hi = bin_hi.reshape(-1, bins, 3)
+
+        # SAH cost of splitting after each bin
+        left_count = numpy.cumsum(counts, axis=1)[:, :-1]
+        right_count = count[:, None] - left_count
+        left_area = half_area(numpy.minimum.accumulate(bin_lo, axis=1),
+                              numpy.maximum.accumulate(bin_hi, axis=1))
+        right_area = half_area(
+            numpy.minimum.accumulate(bin_lo[:, ::-1], axis=1)[:, ::-1],
+            numpy.maximum.accumulate(bin_hi[:, ::-1], axis=1)[:, ::-1])
+        cost = left_count * left_area[:, :-1] + \
+            right_count * right_area[:, 1:]
+        cost[(left_count == 0) | (right_count == 0)] = numpy.inf
+        best = numpy.argmin(cost, axis=1)
+        best_cost = cost[numpy.arange(len(cand)), best]
+        # leaves where splitting costs more than testing every item,
+        # except that big nodes are always split, at the median if no
+        # bin boundary separates their items
+        area = half_area(node_lo[-1][cand], node_hi[-1][cand])
+        split_cand = (TRAVERSAL_COST * area + best_cost <= count * area) | \
+            (count > 4 * leaf_size)
+        split[cand] = split_cand
+        left[cand] = numpy.where(
+            numpy.isfinite(best_cost),
+            numpy.take_along_axis(left_count, best[:, None], 1)[:, 0],
+            count // 2)
+
+        # leaves take their place in order, the rest go down a level
+        moved = numpy.repeat(split_cand, count)
+        if not moved.all():
+            pos = numpy.repeat(level_start[cand] - rel, count) + \
+                numpy.arange(len(ids))
+            order[pos[~moved]] = ids[~moved]
+            ids, alo, ahi = ids[moved], alo[moved], ahi[moved]
+
+        base = total + nodes
+        child = base + 2 * (numpy.cumsum(split) - 1)
+        node_start.append(numpy.where(split, child, level_start))
+        node_count.append(numpy.where(split, 0, level_count))
+        total = base
+
+        s = level_start[split]
+        k = left[split]
+        level_count, level_start = (
+            numpy.stack([k, level_count[split] - k], axis=1).ravel(),
+            numpy.stack([s, s + k], axis=1).ravel())
+
+    def cat(parts, shape, dtype):
+        return numpy.concatenate(parts) if parts \
+            else numpy.zeros(shape, dtype=dtype)
+
+    return (cat(node_lo, (0, 3), numpy.float32),
+            cat(node_hi, (0, 3), numpy.float32),
+            cat(node_start, 0, numpy.int64),
+            cat(node_count, 0, numpy.int64),
+            order)
+
+
+def intersect_boxes(o, inv_d, lo, hi, tmax):
+    # slab test for paired rays and boxes, returns (hit, entry t)
+    with numpy.errstate(invalid='ignore'):
+        t1 = (lo - o) * inv_d
+        t2 = (hi - o) * inv_d
+    # fmin / fmax skip the nans from rays lying in a slab's plane
+    near = numpy.fmin(t1, t2)
+    far = numpy.fmax(t1, t2)
+    near = numpy.fmax(numpy.fmax(numpy.fmax(near[:, 0], near[:, 1]),
+                                 near[:, 2]), 0)
+    far = numpy.fmin(numpy.fmin(numpy.fmin(far[:, 0], far[:, 1]),
+                                far[:, 2]), numpy.inf)
+    return ((near <= far) & (near < tmax), near)
+
+
+def intersect_triangles(o, d, v0, e1, e2, tmax, eps=1e-9):
+    # Moller-Trumbore for paired rays and triangles, returns (hit, t)
+    p = numpy.cross(d, e2)
+    det = numpy.einsum('ij,ij->i', e1, p)
+    ok = numpy.abs(det) > eps
+    inv = 1 / numpy.where(ok, det, 1)
+    s = o - v0
+    u = numpy.einsum('ij,ij->i', s, p) * inv
+    q = numpy.cross(s, e1)
+    v = numpy.einsum('ij,ij->i', d, q) * inv
+    t = numpy.einsum('ij,ij->i', e2, q) * inv
+    hit = ok & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0) & (t < tmax)
+    return (hit, t)
+
+
+class BVH:
+    # a bounding volume hierarchy over boxes, and optionally the
+    # triangles inside them. nodes live in flat arrays, see build().
+    # items are numbered as given, so results index the mesh triangles
+    # or the scene primitives directly.
+
+    def __init__(self, node_lo, node_hi, node_start, node_count, order,
+                 item_lo, item_hi, triangles=None):
+        self.node_lo = node_lo
+        self.node_hi = node_hi
+        self.node_start = node_start
+        self.node_count = node_count
+        self.order = order
+        self.item_lo = item_lo
+        self.item_hi = item_hi
+        # (v0, e1, e2) float64 arrays, or None to hit the boxes
+        self.triangles = triangles
+
+    def __len__(self):
+        return len(self.order)
+
+    @classmethod
+    def from_boxes(cls, lo, hi, leaf_size=LEAF_SIZE, triangles=None):
+        # boxes that are empty or not finite are left out of the tree,
+        # and never hit
+        lo = numpy.asarray(lo, dtype=numpy.float32)
+        hi = numpy.asarray(hi, dtype=numpy.float32)
+        keep = numpy.flatnonzero(numpy.isfinite(lo).all(axis=1) &
+                                 numpy.isfinite(hi).all(axis=1) &
+                                 (lo <= hi).all(axis=1))
+        *nodes, order = build(lo[keep], hi[keep], leaf_size=leaf_size)
+        return cls(*nodes, keep[order], lo, hi, triangles=triangles)
+
+    @classmethod
+    def from_mesh(cls, mesh, leaf_size=LEAF_SIZE):
+        # items are the mesh's triangles
+        pos = mesh.vertices['pos']
+        vs = mesh.triangles['vs'].astype(numpy.int64)
+        bad = (vs >= len(pos)).any(axis=1)
+        vs[bad] = 0
+        p = pos[vs]
+        lo = p.min(axis=1)
+        hi = p.max(axis=1)
+        lo[bad] = numpy.inf
+        hi[bad] = -numpy.inf
+        p = p.astype(numpy.float64)
+        return cls.from_boxes(lo, hi, leaf_size=leaf_size, triangles=(
+            p[:, 0], p[:, 1] - p[:, 0], p[:, 2] - p[:, 0]))
+
+    @classmethod
+    def from_scene(cls, scene, input_directory=None, leaf_size=LEAF_SIZE):
+        # items are the scene's primitives, hit at their world bounds.
+        # unbounded primitives (skies and such) are never hit
+        lo, hi = primitive_bounds(scene.primitives,
+                                  input_directory=input_directory)
+        return cls.from_boxes(lo, hi, leaf_size=leaf_size)
+
+    @classmethod
+    def cached(cls, mesh_path, leaf_size=LEAF_SIZE):
+        # the BVH for a .wo3 file, kept next to it as .bvh.npz and
+        # rebuilt whenever the mesh is newer
+        path = mesh_path + '.bvh.npz'
+        try:
+            if os.path.getmtime(path) >= os.path.getmtime(mesh_path):
+                return cls.load(path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            pass
+        with open(mesh_path, 'rb') as f:
+            bvh = cls.from_mesh(carbide.mesh.Mesh.load(f),
+                                leaf_size=leaf_size)
+        tmp = path + '.tmp'
+        bvh.save(tmp)
+        os.replace(tmp, path)
+        return bvh
+
+    def save(self, f):
+        arrays = dict(node_lo=self.node_lo, node_hi=self.node_hi,
+                      node_start=self.node_start, node_count=self.node_count,
+                      order=self.order, item_lo=self.item_lo,
+                      item_hi=self.item_hi)
+        if self.triangles is not None:
+            arrays.update(zip(['v0', 'e1', 'e2'], self.triangles))
+        if isinstance(f, str):
+            # numpy would add .npz to a name without it
+            with open(f, 'wb') as out:
+                numpy.savez(out, **arrays)
+        else:
+            numpy.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, f):
+        with numpy.load(f) as data:
+            triangles = None
+            if 'v0' in data:
+                triangles = (data['v0'], data['e1'], data['e2'])
+            return cls(data['node_lo'], data['node_hi'], data['node_start'],
+                       data['node_count'], data['order'], data['item_lo'],
+                       data['item_hi'], triangles=triangles)
+
+    def leaf_items(self, nodes):
+        # (index into nodes, item) pairs for the items of leaf nodes
+        count = self.node_count[nodes]
+        which = numpy.repeat(numpy.arange(len(nodes)), count)
+        first = numpy.repeat(self.node_start[nodes] - numpy.cumsum(count)
+                             + count, count)
+        return (which, self.order[first + numpy.arange(len(which))])
+
+    def intersect(self, origins, directions, tmax=numpy.inf, any_hit=False):
+        # closest hit along each ray, as (t, item) with t = inf and
+        # item = -1 for misses. with any_hit, stops at the first hit
+        # found, which is enough for visibility.
+        origins = numpy.atleast_2d(numpy.asarray(origins, dtype=numpy.float64))
+        directions = numpy.atleast_2d(
+            numpy.asarray(directions, dtype=numpy.float64))
+        tmax = numpy.broadcast_to(numpy.asarray(tmax, dtype=numpy.float64),
+                                  (len(origins),))
+        t = numpy.full(len(origins), numpy.inf)
+        item = numpy.full(len(origins), -1, dtype=numpy.int64)
+        for i in range(0, len(origins), RAY_BATCH):
+            s = slice(i, i + RAY_BATCH)
+            t[s], item[s] = self.trace(origins[s], directions[s],
+                                       tmax[s].copy(), any_hit)
+        return (t, item)
+
+    def occluded(self, origins, directions, tmax=numpy.inf):
+        # whether anything lies along each ray before tmax
+        return self.intersect(origins, directions, tmax, any_hit=True)[1] >= 0
+
+    def depth(self):
+        # levels in the tree, which bounds the traversal stacks
+        nodes = numpy.zeros(1 if len(self.node_lo) else 0, dtype=numpy.int64)
+        depth = 0
+        while len(nodes):
+            depth += 1
+            c = self.node_start[nodes[self.node_count[nodes] == 0]]
+            nodes = numpy.concatenate([c, c + 1])
+        return depth
+
+    def hit_items(self, o, d, inv_d, rays, items, tmax, item):
+        # test (ray, item) pairs, keeping each ray's closest hit
+        if self.triangles is not None:
+            v0, e1, e2 = [numpy.take(a, items, axis=0)
+                          for a in self.triangles]
+            hit, t = intersect_triangles(o[rays], d[rays], v0, e1, e2,
+                                         tmax[rays])
+        else:
+            hit, t = intersect_boxes(o[rays], inv_d[rays],
+                                     numpy.take(self.item_lo, items, axis=0),
+                                     numpy.take(self.item_hi, items, axis=0),
+                                     tmax[rays])
+        rays, t, items = rays[hit], t[hit], items[hit]
+        by_t = numpy.lexsort((t, rays))
+        rays, t, items = rays[by_t], t[by_t], items[by_t]
+        first = numpy.flatnonzero(numpy.diff(rays, prepend=-1))
+        rays, t, items = rays[first], t[first], items[first]
+        tmax[rays] = t
+        item[rays] = items
+
+    def trace(self, o, d, tmax, any_hit):
+        # every ray keeps its own stack of (node, entry t), and each
+        # step pops one node for all the rays at once. near children
+        # are visited first, so far ones are mostly culled by tmax.
+        with numpy.errstate(divide='ignore'):
+            inv_d = 1 / d
+        n = len(o)
+        item = numpy.full(n, -1, dtype=numpy.int64)
+        if not len(self.node_lo):
+            return (numpy.full(n, numpy.inf), item)
+        size = self.depth() + 1
+        stack = numpy.empty((n, size), dtype=numpy.int64)
+        stack_t = numpy.empty((n, size))
+        sp = numpy.zeros(n, dtype=numpy.int64)
+
+        root = numpy.zeros(n, dtype=numpy.int64)
+        hit, near = intersect_boxes(o, inv_d, self.node_lo[root],
+                                    self.node_hi[root], tmax)
+        rays = numpy.flatnonzero(hit)
+        stack[rays, 0] = 0
+        stack_t[rays, 0] = near[rays]
+        sp[rays] = 1
+        while len(rays):
+            sp[rays] -= 1
+            nodes = stack[rays, sp[rays]]
+            live = stack_t[rays, sp[rays]] < tmax[rays]
+            rays, nodes = rays[live], nodes[live]
+
+            leaf = self.node_count[nodes] > 0
+            which, items = self.leaf_items(nodes[leaf])
+            self.hit_items(o, d, inv_d, rays[leaf][which], items, tmax, item)
+
+            r = rays[~leaf]
+            c = self.node_start[nodes[~leaf]]
+            h0, t0 = intersect_boxes(o[r], inv_d[r],
+                                     numpy.take(self.node_lo, c, axis=0),
+                                     numpy.take(self.node_hi, c, axis=0),
+                                     tmax[r])
+            h1, t1 = intersect_boxes(o[r], inv_d[r],
+                                     numpy.take(self.node_lo, c + 1, axis=0),
+                                     numpy.take(self.node_hi, c + 1, axis=0),
+                                     tmax[r])
+            # push the far child first, so the near one pops next
+            swap = t1 < t0
+            for h, child, t in [
+                    (numpy.where(swap, h0, h1), numpy.where(swap, c, c + 1),
+                     numpy.where(swap, t0, t1)),
+                    (numpy.where(swap, h1, h0), numpy.where(swap, c + 1, c),
+                     numpy.where(swap, t1, t0))]:
+                pushed = r[h]
+                stack[pushed, sp[pushed]] = child[h]
+                stack_t[pushed, sp[pushed]] = t[h]
+                sp[pushed] += 1
+
+            rays = numpy.flatnonzero(sp)
+            if any_hit:
+                rays = rays[item[rays] < 0]
+        return (numpy.where(item >= 0, tmax, numpy.inf), item)
+
+    def query_box(self, lo, hi):
+        # sorted items whose boxes overlap the box lo, hi
+        lo = numpy.asarray(lo, dtype=numpy.float32)
+        hi = numpy.asarray(hi, dtype=numpy.float32)
+        nodes = numpy.zeros(1 if len(self.node_lo) else 0, dtype=numpy.int64)
+        found = []
+        while len(nodes):
+            overlap = numpy.all((self.node_lo[nodes] <= hi) &
+                                (self.node_hi[nodes] >= lo), axis=1)
+            nodes = nodes[overlap]
+            leaf = self.node_count[nodes] > 0
+            _, items = self.leaf_items(nodes[leaf])
+            items = items[numpy.all((self.item_lo[items] <= hi) &
+                                    (self.item_hi[items] >= lo), axis=1)]
+            found.append(items)
+            c = self.node_start[nodes[~leaf]]
+            nodes = numpy.stack([c, c + 1], axis=1).ravel()
+        if not found:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return numpy.sort(numpy.concatenate(found))
@@ -5,10 +5,15 @@ import tempfile
 
 from carbide.blender.register import add_class
 import carbide.blender.preferences
+import carbide.mesh
 import carbide.tungsten
 import carbide.scene
 
 
+# fraction of mesh triangles kept in material previews
+PREVIEW_RATIO = 0.1
+
+
 @add_class
 class TungstenRenderEngine(bpy.types.RenderEngine):
     bl_idname = 'TUNGSTEN'
@@ -56,8 +61,16 @@ class TungstenRenderEngine(bpy.types.RenderEngine):
             scenefile = os.path.join(tmp, 'scene.json')
             previewfile = os.path.join(tmp, 'preview.png')
             start = time.time()
+            scene = self.scene
+            if self.is_preview:
+                cache = carbide.scene.preview_cache()
+                if prefs.mesh_cache_path:
+                    cache = carbide.mesh.MeshCache(
+                        bpy.path.abspath(prefs.mesh_cache_path),
+                        max_size=int(prefs.mesh_cache_size * 2**30) or None)
+                scene = scene.decimated(PREVIEW_RATIO, tmp, cache=cache)
             with open(scenefile, 'w') as f:
-                self.scene.dump(self.scene, f)
+                scene.dump(scene, f)
 
             # try to launch tungsten
             try:
@@ -73,6 +73,16 @@ class W_PT_material(properties_material.MaterialButtonsPanel, base.RootPanel):
 
         return obj, mat
 
+    @classmethod
+    def has_emission_or_media(self, m):
+        # what to_scene_data would say about emission and media, without
+        # exporting anything
+        w = m.tungsten
+        ntree = w.material.normalize(w)
+        if ntree and ntree.output:
+            return ntree.output.has_emission_or_media()
+        return any(w.emission)
+
     def draw(self, context):
         layout = self.layout
 
@@ -158,6 +168,14 @@ class TungstenMaterialOutputNode(TungstenNode):
 
         return obj, mat
 
+    def has_emission_or_media(self):
+        # linked emission may still be black, but this errs on the side
+        # of yes
+        emission = self.inputs['Emission']
+        return emission.is_linked or any(emission.default_color) or \
+            self.inputs['Interior'].is_linked or \
+            self.inputs['Exterior'].is_linked
+
     def draw_buttons(self, context, layout):
         if self.inputs['Bump'].is_linked:
             layout.prop(self, 'bump_strength')
@@ -1,4 +1,5 @@
 import bpy
+import numpy
 import os.path
 import struct
 import time
@@ -6,6 +7,7 @@ from bpy_extras.io_utils import ImportHelper, ExportHelper
 from bl_ui import properties_data_mesh
 
 from . import base
+import carbide.mesh
 
 base.compatify_class(properties_data_mesh.DATA_PT_context_mesh)
 base.compatify_class(properties_data_mesh.DATA_PT_normals)
@@ -51,86 +53,71 @@ def read_mesh(mesh, path):
     mesh.validate()
     mesh.update()
 
-def write_object_mesh(scene, obj, path, apply_modifiers=True, **kwargs):
+def object_to_carbide_mesh(scene, obj, apply_modifiers=True, **kwargs):
     if obj.type != 'MESH' or (apply_modifiers and obj.is_modified(scene, 'RENDER')):
         try:
             mesh = obj.to_mesh(scene, True, 'RENDER')
-            verts, tris = write_mesh(mesh, path, **kwargs)
+            return to_carbide_mesh(mesh, **kwargs)
         finally:
             bpy.data.meshes.remove(mesh)
     else:
-        verts, tris = write_mesh(obj.data, path, **kwargs)
-    return (verts, tris)
+        return to_carbide_mesh(obj.data, **kwargs)
 
-def write_mesh(mesh, path, use_normals=True):
+def write_object_mesh(scene, obj, path, apply_modifiers=True, optimize_layout=False, **kwargs):
+    m = object_to_carbide_mesh(scene, obj, apply_modifiers=apply_modifiers, **kwargs)
+    return save_mesh(m, path, optimize_layout=optimize_layout)
+
+def to_carbide_mesh(mesh, use_normals=True):
     mesh.calc_normals()
-    if not mesh.tessfaces and mesh.polygons:
-        mesh.calc_tessface()
-
-    has_uv = bool(mesh.tessface_uv_textures)
-
-    if has_uv:
-        active_uv_layer = mesh.tessface_uv_textures.active
-        if not active_uv_layer:
-            has_uv = False
-        else:
-            active_uv_layer = active_uv_layer.data
-
-    verts = mesh.vertices
-    wo3_verts = bytearray()
-    verti = 0
-    wo3_indices = [{} for _ in range(len(verts))]
-    wo3_tris = bytearray()
-    trii = 0
-
-    uvcoord = (0.0, 0.0)
-    for i, f in enumerate(mesh.tessfaces):
-        smooth = f.use_smooth
-        if use_normals and not smooth:
-            normal = f.normal[:]
-
-        if has_uv:
-            uv = active_uv_layer[i]
-            uv = (uv.uv1, uv.uv2, uv.uv3, uv.uv4)
-
-        oi = []
-        for j, vidx in enumerate(f.vertices):
-            v = verts[vidx]
-
-            if not use_normals or smooth:
-                normal = v.normal[:]
-
-            if has_uv:
-                uvcoord = (uv[j][0], uv[j][1])
-
-            key = (normal, uvcoord)
-            out_idx = wo3_indices[vidx].get(key)
-            if out_idx is None:
-                out_idx = verti
-                wo3_indices[vidx][key] = out_idx
-                wo3_verts += VERTFMT.pack(v.co[0], v.co[1], v.co[2], normal[0], normal[1], normal[2], uvcoord[0], uvcoord[1])
-                verti += 1
-
-            oi.append(out_idx)
-
-        matid = f.material_index
-        if len(oi) == 3:
-            # triangle
-            wo3_tris += TRIFMT.pack(oi[0], oi[1], oi[2], matid)
-            trii += 1
-        else:
-            # quad
-            wo3_tris += TRIFMT.pack(oi[0], oi[1], oi[2], matid)
-            wo3_tris += TRIFMT.pack(oi[0], oi[2], oi[3], matid)
-            trii += 2
 
+    def get(seq, attr, dtype, width=1):
+        a = numpy.empty(len(seq) * width, dtype=dtype)
+        seq.foreach_get(attr, a)
+        if width > 1:
+            a = a.reshape(-1, width)
+        return a
+
+    positions = get(mesh.vertices, 'co', numpy.float32, 3)
+    vertex_normals = get(mesh.vertices, 'normal', numpy.float32, 3)
+    loop_vertex = get(mesh.loops, 'vertex_index', numpy.int32)
+
+    loop_start = get(mesh.polygons, 'loop_start', numpy.int32)
+    face_sizes = get(mesh.polygons, 'loop_total', numpy.int32)
+    material_ids = get(mesh.polygons, 'material_index', numpy.int32)
+    smooth = get(mesh.polygons, 'use_smooth', bool)
+    face_normals = get(mesh.polygons, 'normal', numpy.float32, 3)
+
+    # loops in polygon order
+    faces = numpy.repeat(numpy.arange(len(face_sizes)), face_sizes)
+    offsets = numpy.cumsum(face_sizes) - face_sizes
+    loops = numpy.arange(len(faces)) + numpy.repeat(loop_start - offsets,
+                                                   face_sizes)
+    corners = loop_vertex[loops]
+
+    # smooth faces use vertex normals, flat faces use the face normal
+    normals = vertex_normals[corners]
+    if use_normals:
+        flat = ~smooth[faces]
+        normals[flat] = face_normals[faces[flat]]
+
+    uvs = None
+    if mesh.uv_layers.active:
+        uvs = get(mesh.uv_layers.active.data, 'uv', numpy.float32, 2)[loops]
+
+    return carbide.mesh.Mesh.from_corners(positions, normals, uvs, corners,
+                                          face_sizes, material_ids)
+
+def save_mesh(m, path, optimize_layout=False):
+    if optimize_layout:
+        m = m.optimize_layout()
     with open(path, 'wb') as f:
-        f.write(LENFMT.pack(verti))
-        f.write(wo3_verts)
-        f.write(LENFMT.pack(trii))
-        f.write(wo3_tris)
+        m.dump(f)
+
+    return (len(m.vertices), len(m.triangles))
 
-    return (verti, trii)
+def write_mesh(mesh, path, use_normals=True, optimize_layout=False):
+    m = to_carbide_mesh(mesh, use_normals=use_normals)
+    return save_mesh(m, path, optimize_layout=optimize_layout)
 
 @base.register_menu_item(bpy.types.INFO_MT_file_import, text='Tungsten (.wo3)')
 class W_OT_wo3_import(bpy.types.Operator, ImportHelper):
@@ -197,6 +184,12 @@ class W_OT_wo3_export(bpy.types.Operator, ExportHelper):
         default=True,
     )
 
+    optimize_layout = bpy.props.BoolProperty(
+        name='Optimize Layout',
+        description='Reorder triangles and vertices for locality',
+        default=False,
+    )
+
     @classmethod
     def poll(cls, context):
         return context.active_object != None
@@ -208,7 +201,7 @@ class W_OT_wo3_export(bpy.types.Operator, ExportHelper):
         start = time.time()
         scene = context.scene
         obj = context.active_object
-        verts, tris = write_object_mesh(scene, obj, path, apply_modifiers=self.apply_modifiers, use_normals=self.use_normals)
+        verts, tris = write_object_mesh(scene, obj, path, apply_modifiers=self.apply_modifiers, use_normals=self.use_normals, optimize_layout=self.optimize_layout)
         end = time.time()
         print('wrote', os.path.split(path)[1], 'in', end - start, 's -', verts, 'verts,', tris, 'tris')
         return {'FINISHED'}
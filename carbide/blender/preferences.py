@@ -14,10 +14,26 @@ class TungstenPreferences(bpy.types.AddonPreferences):
         default='',
     )
 
+    mesh_cache_path: bpy.props.StringProperty(
+        name="Mesh Cache Path",
+        description="Directory to share unchanged meshes between exports",
+        subtype='DIR_PATH',
+        default='',
+    )
+
+    mesh_cache_size: bpy.props.FloatProperty(
+        name="Mesh Cache Size (GB)",
+        description="Maximum size of the mesh cache, 0 for no limit",
+        min=0.0,
+        default=0.0,
+    )
+
     def draw(self, context):
         lay = self.layout
 
         lay.prop(self, 'tungsten_server_path')
+        lay.prop(self, 'mesh_cache_path')
+        lay.prop(self, 'mesh_cache_size')
 
 def get():
     return bpy.context.preferences.addons[__package__.split('.')[0]] \
@@ -7,15 +7,19 @@ import json
 import time
 import zipfile
 import math
+import numpy
 from mathutils import Vector, Matrix
 from bl_ui import properties_scene
 
 from . import base
+from . import preferences
+import carbide.mesh
+from carbide.scene.camera import frustum_visible
 from .render import W_PT_renderer, W_PT_integrator
 from .material import W_PT_material
 from .camera import W_PT_camera
 from .world import W_PT_world
-from .mesh import write_object_mesh
+from .mesh import object_to_carbide_mesh, write_object_mesh
 from .lamp import W_PT_lamp
 from .texture import W_PT_texture
 
@@ -51,6 +55,19 @@ class W_OT_export(bpy.types.Operator):
         default=True,
     )
 
+    cull = bpy.props.BoolProperty(
+        name='Cull Hidden Objects',
+        description='Skip objects outside the camera view',
+        default=False,
+    )
+
+    cull_margin = bpy.props.FloatProperty(
+        name='Cull Margin',
+        description='Keep objects this close to the view, as a fraction of the scene size',
+        min=0.0,
+        default=0.1,
+    )
+
     @classmethod
     def poll(cls, context):
         return context.scene.render.engine == 'TUNGSTEN'
@@ -66,6 +83,9 @@ class W_OT_export(bpy.types.Operator):
             layout.prop(self, 'zip')
             if self.zip:
                 layout.prop(self, 'compress')
+        layout.prop(self, 'cull')
+        if self.cull:
+            layout.prop(self, 'cull_margin')
 
     def execute(self, context):
         path = self.filepath
@@ -77,14 +97,20 @@ class W_OT_export(bpy.types.Operator):
                 self.report({'WARNING'}, 'Please select a directory, not a file.')
                 return {'CANCELLED'}
 
+        cull_margin = self.cull_margin if self.cull else None
+        mesh_cache = None
+        prefs = preferences.get()
+        if prefs.mesh_cache_path:
+            mesh_cache = carbide.mesh.MeshCache(bpy.path.abspath(prefs.mesh_cache_path), max_size=int(prefs.mesh_cache_size * 2**30) or None)
+
         if self.zip:
-            s = TungstenScene(self_contained=self.self_contained)
-            s.add_all(context.scene)
+            s = TungstenScene(self_contained=self.self_contained, mesh_cache=mesh_cache)
+            s.add_all(context.scene, cull_margin=cull_margin)
             s.save()
             s.to_zip(path, compress=self.compress)
         else:
-            s = TungstenScene(clean_on_del=False, self_contained=self.self_contained, path=path)
-            s.add_all(context.scene)
+            s = TungstenScene(clean_on_del=False, self_contained=self.self_contained, path=path, mesh_cache=mesh_cache)
+            s.add_all(context.scene, cull_margin=cull_margin)
             s.save()
         
         return {'FINISHED'}
@@ -115,7 +141,7 @@ def orientify(m):
     ])
 
 class TungstenScene:
-    def __init__(self, clean_on_del=True, self_contained=False, path=None):
+    def __init__(self, clean_on_del=True, self_contained=False, path=None, mesh_cache=None):
         self.dir = path
         if path is None:
             self.dir = tempfile.mkdtemp(suffix='w')
@@ -125,6 +151,9 @@ class TungstenScene:
         
         self.clean_on_del = clean_on_del
         self.self_contained = self_contained
+        # self-contained scenes need the mesh files inside, so they
+        # cannot point into a carbide.mesh.MeshCache
+        self.mesh_cache = None if self_contained else mesh_cache
         self.scene = {
             'media': [],
             'bsdfs': [
@@ -192,7 +221,9 @@ class TungstenScene:
         with open(self.scenefile, 'w') as f:
             json.dump(self.scene, f, indent=4)
 
-    def add_all(self, scene, preview=False):
+    def add_all(self, scene, preview=False, cull_margin=None):
+        # with cull_margin, objects the camera cannot see are skipped,
+        # as in carbide.scene.Scene.culled
         start = time.time()
         
         d = W_PT_renderer.to_scene_data(self, scene)
@@ -205,9 +236,12 @@ class TungstenScene:
             self.add_world(scene.world)
         self.add_camera(scene, scene.camera)
 
-        for o in scene.objects.values():
-            if any(a and b for a, b in zip(scene.layers, o.layers)):
-                self.add_object(scene, o)
+        objects = [o for o in scene.objects.values()
+                   if any(a and b for a, b in zip(scene.layers, o.layers))]
+        if cull_margin is not None:
+            objects = self.cull_objects(objects, cull_margin)
+        for o in objects:
+            self.add_object(scene, o)
 
         if preview:
             self.munge_preview(scene)
@@ -215,6 +249,34 @@ class TungstenScene:
         end = time.time()
         print('wrote scene in', end - start, 's')
 
+    def cull_objects(self, objects, margin):
+        cam = self.scene['camera']
+        if cam.get('type') not in {'pinhole', 'thinlens'}:
+            return objects
+        geometry = []
+        for o in objects:
+            if o.type not in {'MESH', 'CURVE', 'SURFACE', 'META', 'FONT'}:
+                continue
+            # emitters and media are always kept, as in Scene.culled
+            if len(o.material_slots) > 0 and o.material_slots[0].material:
+                if W_PT_material.has_emission_or_media(o.material_slots[0].material):
+                    continue
+            geometry.append(o)
+        if not geometry:
+            return objects
+
+        corners = numpy.array([[tuple(o.matrix_world * Vector(c)) for c in o.bound_box]
+                               for o in geometry])
+        lo = corners.min(axis=1)
+        hi = corners.max(axis=1)
+        size = numpy.linalg.norm(hi.max(axis=0) - lo.min(axis=0))
+        visible = frustum_visible(numpy.reshape(cam['transform'], (4, 4)),
+                                  cam['fov'], cam['resolution'], lo, hi,
+                                  margin=margin * size + cam.get('aperture_size', 0.0))
+        hidden = {o.name for o, v in zip(geometry, visible) if not v}
+        print('culled', len(hidden), 'of', len(objects), 'objects')
+        return [o for o in objects if o.name not in hidden]
+
     def munge_preview(self, scene):
         def lookup(ln, n, default=None):
             l = self.scene[ln]
@@ -374,12 +436,18 @@ class TungstenScene:
         fulloutname = self.path(outname)
 
         start = time.time()
-        verts, tris = write_object_mesh(scene, o, fulloutname)
+        if self.mesh_cache is not None:
+            m = object_to_carbide_mesh(scene, o)
+            fname = self.mesh_cache.store(m)
+            verts, tris = len(m.vertices), len(m.triangles)
+        else:
+            fname = outname
+            verts, tris = write_object_mesh(scene, o, fulloutname)
         end = time.time()
         print('wrote', outname, 'in', end - start, 's -', verts, 'verts,', tris, 'tris')
 
-        self.meshes[outname] = outname
-        return outname
+        self.meshes[outname] = fname
+        return fname
 
     def add_object(self, scene, o):
         dat = {
@@ -0,0 +1,207 @@
+import dataclasses
+import io
+import struct
+
+import numpy
+
+import carbide.mesh
+
+# Cem Yuksel's .hair format, which Tungsten reads for curves primitives:
+# HAIR_HEADER, then whichever of these arrays the flags say are present,
+# each with one entry per strand or per point: segment counts (uint16),
+# points (float32 x 3), thickness, transparency, color (float32 x 3).
+# absent arrays take the defaults in the header.
+HAIR_MAGIC = b'HAIR'
+# magic, strand count, point count, flags, default segment count,
+# default thickness, default transparency, default color, info
+HAIR_HEADER = struct.Struct('=4sIIIIff3f88s')
+HAIR_SEGMENTS = 1
+HAIR_POINTS = 2
+HAIR_THICKNESS = 4
+HAIR_TRANSPARENCY = 8
+HAIR_COLOR = 16
+# segment counts are uint16
+MAX_SEGMENTS = 0xffff
+
+
+def read_hair_header(f):
+    # returns (strand count, point count, flags, default segments,
+    #          default thickness), leaving f at the first array
+    header = f.read(HAIR_HEADER.size)
+    if len(header) != HAIR_HEADER.size:
+        raise ValueError('truncated hair file')
+    magic, ns, npoints, flags, segments, thickness, _, _, _, _, _ = \
+        HAIR_HEADER.unpack(header)
+    if magic != HAIR_MAGIC:
+        raise ValueError('not a hair file')
+    if not flags & HAIR_POINTS:
+        raise ValueError('hair file has no points')
+    return (ns, npoints, flags, segments, thickness)
+
+
+def read_array(f, dtype, count):
+    a = numpy.frombuffer(f.read(dtype.itemsize * count), dtype=dtype)
+    if len(a) != count:
+        raise ValueError('truncated hair file')
+    return a
+
+
+@dataclasses.dataclass
+class Curves:
+    # strand i is points[offsets[i]:offsets[i + 1]], with one thickness
+    # (diameter) per point
+    # shape = (n, 3), float32
+    points: numpy.ndarray
+    # shape = (n,), float32
+    thickness: numpy.ndarray
+    # shape = (strands + 1,), int64, starting at 0 and ending at n
+    offsets: numpy.ndarray
+    copy: dataclasses.InitVar[bool] = True
+
+    def __post_init__(self, copy):
+        convert = numpy.array if copy else numpy.asarray
+        self.points = convert(self.points, dtype=numpy.float32) \
+                          .reshape(-1, 3)
+        self.thickness = convert(self.thickness, dtype=numpy.float32)
+        self.offsets = convert(self.offsets, dtype=numpy.int64)
+        if self.thickness.shape != (len(self.points),):
+            raise ValueError('need one thickness per point')
+        if len(self.offsets) == 0 or self.offsets[0] != 0 or \
+           self.offsets[-1] != len(self.points) or \
+           numpy.any(numpy.diff(self.offsets) < 1):
+            raise ValueError('bad curve offsets')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def from_counts(cls, points, thickness, counts):
+        # counts is the number of points in each strand
+        counts = numpy.asarray(counts, dtype=numpy.int64)
+        offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=offsets[1:])
+        thickness = numpy.broadcast_to(numpy.asarray(
+            thickness, dtype=numpy.float32), (offsets[-1],))
+        return cls(points, thickness, offsets)
+
+    @classmethod
+    def from_strands(cls, strands, thickness=1.0):
+        # strands is a list of (k, 3) point arrays, sharing a thickness
+        strands = [numpy.asarray(s, dtype=numpy.float32).reshape(-1, 3)
+                   for s in strands]
+        points = numpy.concatenate(strands) if strands \
+            else numpy.zeros((0, 3), dtype=numpy.float32)
+        return cls.from_counts(points, thickness, [len(s) for s in strands])
+
+    def counts(self):
+        return numpy.diff(self.offsets)
+
+    def strand_ids(self):
+        # the strand each point belongs to
+        return numpy.repeat(numpy.arange(len(self)), self.counts())
+
+    def bounds(self):
+        # (min, max) corners, padded by the thickness, or None if empty
+        if not len(self.points):
+            return None
+        r = self.thickness.max() / 2
+        return (self.points.min(axis=0) - r, self.points.max(axis=0) + r)
+
+    def transformed(self, m):
+        # a copy with the 4x4 matrix m (or anything with one as .m)
+        # baked in. thickness scales with the matrix's average scale.
+        return merge([self], [m])
+
+    def subsampled(self, ratio, seed=0, widen=True):
+        # a copy with about ratio of the strands, picked at random. with
+        # widen, the survivors thicken to cover the same area.
+        if not 0 < ratio <= 1:
+            raise ValueError('subsample ratio must be in (0, 1]')
+        rng = numpy.random.default_rng(seed)
+        keep = rng.random(len(self)) < ratio
+        counts = self.counts()[keep]
+        mask = numpy.repeat(keep, self.counts())
+        thickness = self.thickness[mask]
+        if widen:
+            thickness = thickness / ratio
+        return self.__class__.from_counts(self.points[mask], thickness,
+                                          counts)
+
+    def dump(self, f, info=b''):
+        counts = self.counts()
+        if numpy.any(counts > MAX_SEGMENTS + 1):
+            raise ValueError('hair files allow at most {} segments per '
+                             'strand'.format(MAX_SEGMENTS))
+        flags = HAIR_POINTS | HAIR_THICKNESS
+        # the segments array can go when every strand has the same size
+        segments = counts[0] - 1 if len(counts) else 0
+        if numpy.any(counts != segments + 1):
+            flags |= HAIR_SEGMENTS
+        f.write(HAIR_HEADER.pack(HAIR_MAGIC, len(self), len(self.points),
+                                 flags, segments, 1.0, 0.0, 1.0, 1.0, 1.0,
+                                 info[:88]))
+        if flags & HAIR_SEGMENTS:
+            f.write((counts - 1).astype('<u2').tobytes())
+        f.write(numpy.ascontiguousarray(self.points, dtype='<f4').tobytes())
+        f.write(numpy.ascontiguousarray(self.thickness,
+                                        dtype='<f4').tobytes())
+
+    def dumpb(self, info=b''):
+        f = io.BytesIO()
+        self.dump(f, info=info)
+        return f.getvalue()
+
+    @classmethod
+    def load(cls, f):
+        ns, npoints, flags, segments, thickness = read_hair_header(f)
+        if flags & HAIR_SEGMENTS:
+            counts = read_array(f, numpy.dtype('<u2'), ns).astype(
+                numpy.int64) + 1
+        else:
+            counts = numpy.full(ns, segments + 1, dtype=numpy.int64)
+        if counts.sum() != npoints:
+            raise ValueError('hair file strands do not match its points')
+        points = read_array(f, numpy.dtype('<f4'), 3 * npoints)
+        if flags & HAIR_THICKNESS:
+            thickness = read_array(f, numpy.dtype('<f4'), npoints)
+        # transparency and color are not used by Tungsten, so skip them
+        return cls.from_counts(points, thickness, counts)
+
+    @classmethod
+    def loadb(cls, data):
+        return cls.load(io.BytesIO(data))
+
+
+def merge(curves, transforms=None, chunk_size=carbide.mesh.CHUNK):
+    # concatenate curves into one, baking in per-set transforms (4x4
+    # matrices, or anything with one as .m, like scene.Transform)
+    curves = list(curves)
+    counts = [c.counts() for c in curves]
+    npoints = numpy.array([len(c.points) for c in curves], dtype=numpy.int64)
+    points = numpy.empty((int(npoints.sum()), 3), dtype=numpy.float32)
+    thickness = numpy.empty(len(points), dtype=numpy.float32)
+    if curves:
+        numpy.concatenate([c.points for c in curves], out=points)
+        numpy.concatenate([c.thickness for c in curves], out=thickness)
+    counts = numpy.concatenate(counts) if counts else \
+        numpy.zeros(0, dtype=numpy.int64)
+
+    if transforms is not None:
+        m = numpy.array([getattr(t, 'm', t) for t in transforms],
+                        dtype=numpy.float64)
+        if m.shape != (len(curves), 4, 4):
+            raise ValueError('need one 4x4 transform per curves')
+        linear = m[:, :3, :3]
+        offset = m[:, :3, 3]
+        scale = numpy.cbrt(numpy.abs(numpy.linalg.det(linear)))
+        # each set's points are contiguous, so transform them in slices
+        # instead of gathering a matrix per point
+        ends = numpy.cumsum(npoints)
+        for j, (start, end) in enumerate(zip(ends - npoints, ends)):
+            for i in range(start, end, chunk_size):
+                s = slice(i, min(i + chunk_size, end))
+                points[s] = points[s] @ linear[j].T.astype(numpy.float32) \
+                    + offset[j]
+            thickness[start:end] *= scale[j]
+
+    return Curves.from_counts(points, thickness, counts)
@@ -1,5 +1,16 @@
+import collections
+import concurrent.futures
 import dataclasses
+import hashlib
+import io
+import lzma
+import os
+import os.path
+import shutil
 import struct
+import tempfile
+import warnings
+import zlib
 
 import numpy
 
@@ -17,8 +28,466 @@ Triangle = numpy.dtype([
 ])
 
 
+# 14 bytes instead of 32, see CompactMesh
+CompactVertex = numpy.dtype([
+    # quantized to the mesh bounds
+    ('pos', numpy.uint16, 3),
+    # octahedral, 0 in the first component for a zero normal
+    ('normal', numpy.uint16, 2),
+    ('uv', numpy.float16, 2),
+])
+
+
 LENFMT = struct.Struct('=Q')
 
+# compressed .wo3 files are ZMAGIC, ZHEADER, ZLOCATOR, the compressed
+# chunks of the plain file, an index of ZINDEX entries, and ZTRAILER.
+# the magic reads as an impossible vertex count, so it cannot be
+# mistaken for a plain .wo3 header. offsets are from the magic.
+ZMAGIC = b'\x89CWO3\r\n\x1a'
+# version, codec, uncompressed chunk size
+ZHEADER = struct.Struct('=BBxxI')
+# trailer offset, so other data can follow a compressed mesh. version 1
+# files have no locator, and end with their trailer
+ZLOCATOR = struct.Struct('=Q')
+# offset, compressed size
+ZINDEX = struct.Struct('=QQ')
+# index offset, chunk count, uncompressed size
+ZTRAILER = struct.Struct('=QQQ')
+ZVERSION = 2
+ZCHUNK_SIZE = 1 << 22
+
+# mesh archives are AMAGIC, AHEADER, the members as plain .wo3 files
+# each padded to AALIGN bytes, then the index: an AENTRY and utf-8 name
+# for each member
+AMAGIC = b'\x89CWA1\r\n\x1a'
+# index offset, member count
+AHEADER = struct.Struct('=QQ')
+# offset, vertex count, triangle count, name length
+AENTRY = struct.Struct('=QQQH')
+AALIGN = 64
+
+# mesh sequences are SMAGIC, SHEADER, a compressed topology block (the
+# first frame as a plain .wo3), one compressed block per frame, then an
+# index of SENTRY for the topology and each frame. frames hold the
+# positions, and optionally normals, as float32 bits, XORed with the
+# frame before unless they are keyframes, then split into byte planes.
+SMAGIC = b'\x89CWS1\r\n\x1a'
+# version, codec, flags, keyframe interval, vertex count,
+# triangle count, index offset, frame count
+SHEADER = struct.Struct('=BBBxIQQQQ')
+# offset, compressed size
+SENTRY = struct.Struct('=QQ')
+SVERSION = 1
+# flags
+SNORMALS = 1
+
+# name: (id, compress(data, level), decompress(data))
+CODECS = {
+    'zlib': (1, lambda data, level: zlib.compress(
+        data, -1 if level is None else level), zlib.decompress),
+    'lzma': (2, lambda data, level: lzma.compress(data, preset=level),
+             lzma.decompress),
+}
+
+# rows processed at a time by passes that must work on memory-mapped
+# meshes without pulling them entirely into memory
+CHUNK = 1 << 20
+
+
+# returns (vertex count, triangle count, vertex offset, triangle offset)
+# offsets are absolute, so f must be seekable
+def read_header(f):
+    voff = f.tell() + LENFMT.size
+    nv = read_len(f)
+    f.seek(Vertex.itemsize * nv, 1)
+    toff = f.tell() + LENFMT.size
+    nt = read_len(f)
+    return (nv, nt, voff, toff)
+
+
+def read_len(f):
+    data = f.read(LENFMT.size)
+    if len(data) != LENFMT.size:
+        raise ValueError('truncated mesh file')
+    return LENFMT.unpack(data)[0]
+
+
+def weld(keys):
+    # deduplicate a structured array of keys. returns the index of the
+    # first occurrence of each distinct key, in first-use order, and
+    # the index into that for every input key.
+    # keys compare as raw bytes, which sorts several times faster than
+    # field by field. adding 0.0 turns -0.0 into 0.0 so they still match.
+    keys = numpy.array(keys)
+    for name in keys.dtype.names:
+        if keys.dtype[name].base.kind == 'f':
+            keys[name] += 0.0
+    raw = keys.view(numpy.dtype((numpy.void, keys.dtype.itemsize)))
+    _, first, inverse = numpy.unique(raw, return_index=True,
+                                     return_inverse=True)
+    order = numpy.argsort(first)
+    rank = numpy.empty_like(order)
+    rank[order] = numpy.arange(len(order))
+    return first[order], rank[inverse.reshape(-1)]
+
+
+def triangulate(face_sizes, positions=None, method='fan'):
+    # triangulate faces stored as consecutive runs of corners
+    # method is 'fan', or 'ear' to ear-clip concave faces correctly,
+    # which needs per-corner positions. both agree on convex faces.
+    # returns (corner indices, shape (n, 3); face index, shape (n,))
+    face_sizes = numpy.asarray(face_sizes, dtype=numpy.int64)
+    if method == 'fan':
+        return fan_triangulate(face_sizes)
+    if method != 'ear':
+        raise ValueError('unknown triangulation method `{}`'.format(method))
+    if positions is None:
+        raise ValueError('ear clipping needs corner positions')
+    return ear_triangulate(face_sizes, numpy.asarray(positions))
+
+
+def fan_triangulate(face_sizes, starts=None, faces=None):
+    # starts and faces pick out a subset of corner runs and face ids
+    if starts is None:
+        starts = numpy.cumsum(face_sizes) - face_sizes
+    if faces is None:
+        faces = numpy.arange(len(face_sizes))
+    counts = numpy.maximum(face_sizes - 2, 0)
+    faces = numpy.repeat(faces, counts)
+    first = numpy.repeat(starts, counts)
+    k = numpy.arange(len(faces)) - numpy.repeat(numpy.cumsum(counts) - counts,
+                                                counts)
+    corners = numpy.stack([first, first + k + 1, first + k + 2], axis=-1)
+    return (corners, faces)
+
+
+def ear_triangulate(face_sizes, positions):
+    # clips one ear from every unfinished face per pass, so the number
+    # of passes depends on the largest face, not the number of faces
+    def pos(idx):
+        return positions[idx].astype(numpy.float64)
+
+    def facing(e, p, n):
+        return numpy.einsum('ij,ij->i', numpy.cross(e, p), n)
+
+    def convex(live):
+        a, b, d = pos(prv[live]), pos(live), pos(nxt[live])
+        return facing(b - a, d - b, normals[faceof[live]]) > 0
+
+    starts = numpy.cumsum(face_sizes) - face_sizes
+    tris = face_sizes == 3
+    out_faces = [numpy.flatnonzero(tris)]
+    out_corners = [starts[tris, None] + numpy.arange(3)]
+
+    big = numpy.flatnonzero(face_sizes > 3)
+    sizes = face_sizes[big]
+    corner_face = numpy.repeat(big, sizes)
+    k = numpy.arange(len(corner_face)) - numpy.repeat(numpy.cumsum(sizes)
+                                                      - sizes, sizes)
+    live = numpy.repeat(starts[big], sizes) + k
+
+    # polygons as doubly-linked corner lists, indexed by corner
+    ncorners = int(face_sizes.sum())
+    nxt = numpy.zeros(ncorners, dtype=numpy.int64)
+    prv = numpy.zeros(ncorners, dtype=numpy.int64)
+    last = k == numpy.repeat(sizes - 1, sizes)
+    nxt[live] = numpy.where(last, live - k, live + 1)
+    prv[nxt[live]] = live
+    # clip order, so convex faces come out the same as a fan
+    rank = numpy.zeros(ncorners, dtype=numpy.int64)
+    rank[live] = (k - 1) % numpy.repeat(sizes, sizes)
+    faceof = numpy.zeros(ncorners, dtype=numpy.int64)
+    faceof[live] = corner_face
+    remaining = face_sizes.copy()
+
+    # Newell's method gives a robust normal for non-planar faces
+    p, q = pos(live), pos(nxt[live])
+    newell = numpy.stack([
+        (p[:, 1] - q[:, 1]) * (p[:, 2] + q[:, 2]),
+        (p[:, 2] - q[:, 2]) * (p[:, 0] + q[:, 0]),
+        (p[:, 0] - q[:, 0]) * (p[:, 1] + q[:, 1]),
+    ], axis=-1)
+    normals = numpy.zeros((len(face_sizes), 3))
+    if len(big):
+        normals[big] = numpy.add.reduceat(newell,
+                                          numpy.cumsum(sizes) - sizes)
+
+    # faces with no reflex corners are convex, and can be fanned
+    concave = numpy.zeros(len(face_sizes), dtype=bool)
+    concave[faceof[live[~convex(live)]]] = True
+    fan = big[~concave[big]]
+    fan_corners, fan_faces = fan_triangulate(face_sizes[fan], starts[fan], fan)
+    out_faces.append(fan_faces)
+    out_corners.append(fan_corners)
+    live = live[concave[faceof[live]]]
+
+    # live stays sorted by face throughout
+    while len(live):
+        f = faceof[live]
+        a, d = prv[live], nxt[live]
+        pa, pb, pd = pos(a), pos(live), pos(d)
+        n = normals[f]
+        ear = convex(live)
+
+        # a convex corner is an ear if no reflex corner is inside it
+        cand = numpy.flatnonzero(ear)
+        reflex = numpy.flatnonzero(~ear)
+        rf = f[reflex]
+        lo = numpy.searchsorted(rf, f[cand], 'left')
+        count = numpy.searchsorted(rf, f[cand], 'right') - lo
+        pc = numpy.repeat(cand, count)
+        pr = reflex[numpy.repeat(lo, count) + numpy.arange(len(pc))
+                    - numpy.repeat(numpy.cumsum(count) - count, count)]
+        r = live[pr]
+        other = (r != a[pc]) & (r != d[pc])
+        pc, r = pc[other], r[other]
+        pr = pos(r)
+        pn = n[pc]
+        inside = (facing(pb[pc] - pa[pc], pr - pa[pc], pn) >= 0) & \
+                 (facing(pd[pc] - pb[pc], pr - pb[pc], pn) >= 0) & \
+                 (facing(pa[pc] - pd[pc], pr - pd[pc], pn) >= 0)
+        ear[pc[inside]] = False
+
+        # take the first ear of each face, or any corner if there is
+        # none (degenerate or self-intersecting faces)
+        score = rank[live] + numpy.where(ear, 0, ncorners)
+        order = numpy.lexsort((score, f))
+        _, first = numpy.unique(f[order], return_index=True)
+        idx = order[first]
+        chosen = live[idx]
+        cf = f[idx]
+        out_faces.append(cf)
+        out_corners.append(numpy.stack([prv[chosen], chosen, nxt[chosen]],
+                                       axis=-1))
+
+        nxt[prv[chosen]] = nxt[chosen]
+        prv[nxt[chosen]] = prv[chosen]
+        remaining[cf] -= 1
+
+        done = remaining[cf] == 3
+        x = nxt[chosen[done]]
+        out_faces.append(cf[done])
+        out_corners.append(numpy.stack([prv[x], x, nxt[x]], axis=-1))
+
+        keep = remaining[f] > 3
+        keep[idx] = False
+        live = live[keep]
+
+    faces = numpy.concatenate(out_faces)
+    corners = numpy.concatenate(out_corners)
+    order = numpy.argsort(faces, kind='stable')
+    return (corners[order], faces[order])
+
+
+# how much edge_quadrics weigh against the triangles' own quadrics
+FEATURE_WEIGHT = 10.0
+
+
+def plane_quadrics(n, p, weight):
+    # quadrics of the planes through p with unit normals n, as the 10
+    # distinct coefficients of the symmetric 4x4 matrix (see
+    # quadric_error)
+    d = -numpy.einsum('ij,ij->i', n, p)
+    a, b, c = n.T
+    q = numpy.stack([a * a, a * b, a * c, a * d, b * b, b * c, b * d,
+                     c * c, c * d, d * d], axis=-1)
+    return q * weight[:, None]
+
+
+def quadrics(p0, p1, p2):
+    # area-weighted plane quadrics of triangles
+    n = numpy.cross(p1 - p0, p2 - p0)
+    area = numpy.linalg.norm(n, axis=1)
+    n = n / numpy.maximum(area, 1e-300)[:, None]
+    return plane_quadrics(n, p0, 0.5 * area)
+
+
+def edge_quadrics(p0, p1, n):
+    # quadrics of the planes through edges p0-p1 at right angles to
+    # their triangles (with unit normals n), weighted by the squared
+    # edge length. points can slide along such an edge, but not off it
+    e = p1 - p0
+    m = numpy.cross(e, n)
+    m = m / numpy.maximum(numpy.linalg.norm(m, axis=1), 1e-300)[:, None]
+    return plane_quadrics(m, p0,
+                          FEATURE_WEIGHT * numpy.einsum('ij,ij->i', e, e))
+
+
+def quadric_error(q, p):
+    x, y, z = p.T
+    return (q[:, 0] * x * x + 2 * q[:, 1] * x * y + 2 * q[:, 2] * x * z
+            + 2 * q[:, 3] * x + q[:, 4] * y * y + 2 * q[:, 5] * y * z
+            + 2 * q[:, 6] * y + q[:, 7] * z * z + 2 * q[:, 8] * z
+            + q[:, 9])
+
+
+def cheap_matching(edges, cost, nv, limit, rng, max_rounds=32):
+    # indices of up to limit edges sharing no vertices, cheapest first.
+    # this is taking edges in cost order and skipping those touching a
+    # vertex already taken, done in rounds: each round takes every edge
+    # that is the cheapest left at both its ends. ties are broken at
+    # random, so runs of equal costs (like flat regions) don't take one
+    # round per edge.
+    perm = rng.permutation(len(edges))
+    c = cost[perm]
+    # only the cheapest few can make it in
+    cand = numpy.arange(len(edges))
+    if 4 * limit < len(edges):
+        cand = numpy.sort(numpy.argpartition(c, 4 * limit)[:4 * limit])
+    cand = perm[cand[numpy.argsort(c[cand], kind='stable')]]
+    rank = numpy.empty(len(edges), dtype=numpy.int64)
+    rank[cand] = numpy.arange(len(cand))
+    taken = numpy.zeros(nv, dtype=bool)
+    best = numpy.empty(nv, dtype=numpy.int64)
+    out = []
+    count = 0
+    for _ in range(max_rounds):
+        if not len(cand) or count >= limit:
+            break
+        a, b = edges[cand].T
+        r = rank[cand]
+        best[a] = len(edges)
+        best[b] = len(edges)
+        numpy.minimum.at(best, a, r)
+        numpy.minimum.at(best, b, r)
+        win = (best[a] == r) & (best[b] == r)
+        sel = cand[win]
+        out.append(sel)
+        count += len(sel)
+        taken[a[win]] = True
+        taken[b[win]] = True
+        cand = cand[~(taken[a] | taken[b])]
+    if not out:
+        return numpy.zeros(0, dtype=numpy.int64)
+    sel = numpy.concatenate(out)
+    return sel[numpy.argsort(rank[sel], kind='stable')[:limit]]
+
+
+def unique_edges(tris, nv):
+    # each undirected edge once, as (n, 2) with the smaller index first,
+    # and how many triangles use it
+    e = numpy.concatenate([tris[:, [0, 1]], tris[:, [1, 2]], tris[:, [2, 0]]])
+    e.sort(axis=1)
+    keys, counts = numpy.unique(e[:, 0] * nv + e[:, 1], return_counts=True)
+    return (numpy.stack([keys // nv, keys % nv], axis=-1), counts)
+
+
+def morton_codes(points, lo, hi, bits=21):
+    # z-order curve codes, interleaving bits of the quantized coordinates
+    extent = numpy.maximum(numpy.asarray(hi) - lo, 1e-30)
+    q = (numpy.asarray(points) - lo) * ((2 ** bits - 1) / extent)
+    q = numpy.clip(q, 0, 2 ** bits - 1).astype(numpy.uint64)
+    code = numpy.zeros(len(q), dtype=numpy.uint64)
+    for axis in range(3):
+        x = q[:, axis] & numpy.uint64(0x1fffff)
+        for shift, mask in [(32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff),
+                            (8, 0x100f00f00f00f00f), (4, 0x10c30c30c30c30c3),
+                            (2, 0x1249249249249249)]:
+            x = (x | (x << numpy.uint64(shift))) & numpy.uint64(mask)
+        code |= x << numpy.uint64(axis)
+    return code
+
+
+def encode_octahedral(normals):
+    # unit vectors to the octahedral square, as uint16 pairs in
+    # [1, 65535]. zero and non-finite normals become (0, 0).
+    n = numpy.asarray(normals, dtype=numpy.float64)
+    length = numpy.abs(n).sum(axis=1)
+    valid = numpy.isfinite(length) & (length > 0)
+    n = n / numpy.where(valid, length, 1)[:, None]
+    x, y, z = n[:, 0], n[:, 1], n[:, 2]
+    sx = numpy.where(x >= 0, 1.0, -1.0)
+    sy = numpy.where(y >= 0, 1.0, -1.0)
+    # fold the lower hemisphere over the diagonals
+    lower = z < 0
+    x, y = (numpy.where(lower, (1 - numpy.abs(y)) * sx, x),
+            numpy.where(lower, (1 - numpy.abs(x)) * sy, y))
+    codes = numpy.rint((numpy.stack([x, y], axis=-1) + 1) * 32767) + 1
+    codes = numpy.clip(codes, 1, 65535).astype(numpy.uint16)
+    codes[~valid] = 0
+    return codes
+
+
+def decode_octahedral(codes):
+    codes = numpy.asarray(codes)
+    o = codes.astype(numpy.float64) - 1
+    x = o[:, 0] / 32767 - 1
+    y = o[:, 1] / 32767 - 1
+    z = 1 - numpy.abs(x) - numpy.abs(y)
+    t = numpy.maximum(-z, 0)
+    x = x - numpy.where(x >= 0, t, -t)
+    y = y - numpy.where(y >= 0, t, -t)
+    n = numpy.stack([x, y, z], axis=-1)
+    n /= numpy.linalg.norm(n, axis=1)[:, None]
+    n[codes[:, 0] == 0] = 0
+    return n.astype(numpy.float32)
+
+
+def map_array(path, dtype, count, offset, mode='r'):
+    # numpy refuses to map zero bytes, so empty arrays live on the heap
+    if count == 0:
+        return numpy.zeros(0, dtype=dtype).view(numpy.recarray)
+    return numpy.memmap(path, dtype=dtype, mode=mode, offset=offset,
+                        shape=(count,)).view(numpy.recarray)
+
+
+@dataclasses.dataclass
+class MeshStats:
+    vertex_count: int = 0
+    triangle_count: int = 0
+    # (min, max) corners over finite vertices, None if there are none
+    bounds: tuple = None
+    surface_area: float = 0.0
+    # zero area, or a repeated vertex index
+    degenerate_triangles: int = 0
+    out_of_range_indices: int = 0
+    nonfinite_vertices: int = 0
+    material_counts: dict = dataclasses.field(default_factory=dict)
+
+
+def mesh_stats(vertex_chunks, nv, triangles, gather, chunk_size=CHUNK):
+    # vertex_chunks yields Vertex arrays covering all nv vertices, and
+    # gather(indices) returns the positions of those vertices
+    st = MeshStats(nv, len(triangles))
+
+    lo = numpy.full(3, numpy.inf)
+    hi = numpy.full(3, -numpy.inf)
+    for v in vertex_chunks:
+        pos = v['pos']
+        finite = numpy.isfinite(pos).all(axis=1) & \
+            numpy.isfinite(v['normal']).all(axis=1) & \
+            numpy.isfinite(v['uv']).all(axis=1)
+        st.nonfinite_vertices += int((~finite).sum())
+        pos = pos[numpy.isfinite(pos).all(axis=1)]
+        if len(pos):
+            lo = numpy.minimum(lo, pos.min(axis=0))
+            hi = numpy.maximum(hi, pos.max(axis=0))
+    if numpy.all(lo <= hi):
+        st.bounds = (lo, hi)
+
+    materials = collections.Counter()
+    for i in range(0, len(triangles), chunk_size):
+        t = triangles[i:i + chunk_size]
+        vs = t['vs']
+        bad = vs >= nv
+        st.out_of_range_indices += int(bad.sum())
+        vs = vs[~bad.any(axis=1)]
+
+        p = [gather(vs[:, j]).astype(numpy.float64) for j in range(3)]
+        area = 0.5 * numpy.linalg.norm(
+            numpy.cross(p[1] - p[0], p[2] - p[0]), axis=1)
+        st.surface_area += float(area[numpy.isfinite(area)].sum())
+        degenerate = (area == 0) | (vs[:, 0] == vs[:, 1]) | \
+            (vs[:, 1] == vs[:, 2]) | (vs[:, 2] == vs[:, 0])
+        st.degenerate_triangles += int(degenerate.sum())
+
+        ids, counts = numpy.unique(t['material'], return_counts=True)
+        materials.update(dict(zip(ids.tolist(), counts.tolist())))
+    st.material_counts = dict(sorted(materials.items()))
+
+    return st
+
 
 @dataclasses.dataclass
 class Mesh:
@@ -26,12 +495,388 @@ class Mesh:
     vertices: numpy.recarray
     # dtype = Triangle
     triangles: numpy.recarray
+    # if False, arrays that already have the right dtype are used as-is
+    copy: dataclasses.InitVar[bool] = True
 
-    def __post_init__(self):
-        self.vertices = numpy.array(self.vertices, dtype=Vertex) \
+    def __post_init__(self, copy):
+        convert = numpy.array if copy else numpy.asarray
+        self.vertices = convert(self.vertices, dtype=Vertex) \
+                            .view(numpy.recarray)
+        self.triangles = convert(self.triangles, dtype=Triangle) \
                              .view(numpy.recarray)
-        self.triangles = numpy.array(self.triangles, dtype=Triangle) \
-                              .view(numpy.recarray)
+
+    @classmethod
+    def from_corners(cls, positions, normals, uvs, corner_vertex_index,
+                     face_sizes, material_ids=None, triangulation='ear'):
+        # build a mesh from polygons, given as runs of face_sizes corners
+        # positions are per-vertex, normals and uvs per-corner (or None),
+        # material_ids per-face. corners are welded into one vertex
+        # whenever they share a position, normal and uv.
+        # triangulation is passed on to triangulate() as the method
+        corners = numpy.asarray(corner_vertex_index, dtype=numpy.uint32)
+        face_sizes = numpy.asarray(face_sizes, dtype=numpy.int64)
+        if face_sizes.sum() != len(corners):
+            raise ValueError('face sizes do not match corner count')
+
+        keys = numpy.zeros(len(corners), dtype=[
+            ('v', numpy.uint32),
+            ('normal', numpy.float32, 3),
+            ('uv', numpy.float32, 2),
+        ])
+        keys['v'] = corners
+        if normals is not None:
+            keys['normal'] = normals
+        if uvs is not None:
+            keys['uv'] = uvs
+        first, remap = weld(keys)
+        keys = keys[first]
+
+        vertices = numpy.empty(len(keys), dtype=Vertex)
+        vertices['pos'] = numpy.asarray(positions)[keys['v']]
+        vertices['normal'] = keys['normal']
+        vertices['uv'] = keys['uv']
+
+        tri_corners, tri_faces = triangulate(
+            face_sizes, numpy.asarray(positions)[corners], triangulation)
+        triangles = numpy.empty(len(tri_faces), dtype=Triangle)
+        triangles['vs'] = remap[tri_corners]
+        if material_ids is None:
+            triangles['material'] = 0
+        else:
+            triangles['material'] = numpy.asarray(material_ids)[tri_faces]
+
+        return cls(vertices, triangles, copy=False)
+
+    def decimate(self, target_ratio, max_passes=100):
+        # simplify to about target_ratio of the triangles with the
+        # quadric error metric. each pass collapses a set of cheap edges
+        # sharing no vertices at once (see cheap_matching).
+        # .wo3 splits vertices at uv seams and normal creases, so edges
+        # are found between points, the vertices welded by position, and
+        # the split copies move along with their point. seams, creases,
+        # open edges and material borders are held in place by their
+        # quadrics (see edge_quadrics). only non-manifold points never
+        # move.
+        target = int(len(self.triangles) * target_ratio)
+        nv = len(self.vertices)
+        normal = self.vertices['normal'].astype(numpy.float64)
+        uv = self.vertices['uv'].astype(numpy.float64)
+        tris = self.triangles['vs'].astype(numpy.int64)
+        material = numpy.array(self.triangles['material'])
+
+        # each point is known by its first vertex, which holds its
+        # position and quadric
+        keys = numpy.zeros(nv, dtype=[('pos', numpy.float32, 3)])
+        keys['pos'] = self.vertices['pos']
+        first, point = weld(keys)
+        point = first[point]
+        pos = self.vertices['pos'].astype(numpy.float64)
+
+        def tri_normals(p, t):
+            return numpy.cross(p[t[:, 1]] - p[t[:, 0]],
+                               p[t[:, 2]] - p[t[:, 0]])
+
+        def proper(t):
+            return (t[:, 0] != t[:, 1]) & (t[:, 1] != t[:, 2]) & \
+                (t[:, 2] != t[:, 0])
+
+        # triangles with two corners at one point have no area anyway
+        ptris = point[tris]
+        keep = proper(ptris)
+        tris, ptris, material = tris[keep], ptris[keep], material[keep]
+
+        q = numpy.zeros((nv, 10))
+        for j in range(3):
+            numpy.add.at(q, ptris[:, j], quadrics(*(pos[ptris[:, k]]
+                                                    for k in range(3))))
+
+        # sides with no triangle across using the same two vertices and
+        # material are open edges, seams, creases or material borders
+        sides = numpy.concatenate([tris[:, [j, (j + 1) % 3]]
+                                   for j in range(3)])
+        keys = numpy.zeros(len(sides), dtype=[('vs', numpy.int64, 2),
+                                              ('material', numpy.int32)])
+        keys['vs'] = numpy.sort(sides, axis=1)
+        keys['material'] = numpy.tile(material, 3)
+        _, side = weld(keys)
+        feature = numpy.bincount(side)[side] == 1
+        fn = tri_normals(pos, ptris)
+        fn /= numpy.maximum(numpy.linalg.norm(fn, axis=1), 1e-300)[:, None]
+        ends = point[sides[feature]]
+        eq = edge_quadrics(pos[ends[:, 0]], pos[ends[:, 1]],
+                           numpy.tile(fn, (3, 1))[feature])
+        numpy.add.at(q, ends[:, 0], eq)
+        numpy.add.at(q, ends[:, 1], eq)
+
+        # flat shaded copies, with one triangle and its normal, get the
+        # new one at the end
+        uses = numpy.bincount(tris.ravel(), minlength=nv)
+        faceted = numpy.zeros(nv, dtype=bool)
+        for j in range(3):
+            faceted[tris[:, j]] = numpy.einsum(
+                'ij,ij->i', normal[tris[:, j]], fn) > 0.999
+        faceted &= uses == 1
+
+        edges, counts = unique_edges(ptris, nv)
+        locked = numpy.zeros(nv, dtype=bool)
+        locked[edges[counts > 2].ravel()] = True
+
+        rng = numpy.random.default_rng(0)
+        # points whose collapses were dropped sit out the next pass, so
+        # the same cheapest edges don't keep the others from a turn
+        stuck = numpy.zeros(nv, dtype=bool)
+        for _ in range(max_passes):
+            if len(tris) <= target:
+                break
+            edges, _ = unique_edges(ptris, nv)
+            out = locked | stuck
+            edges = edges[~(out[edges[:, 0]] | out[edges[:, 1]])]
+            if not len(edges):
+                break
+            a, b = edges.T
+
+            # best of the two ends and the midpoint
+            qe = q[a] + q[b]
+            ts = numpy.array([0.0, 0.5, 1.0])
+            costs = numpy.stack([quadric_error(qe, pos[a] + t * (pos[b]
+                                                                - pos[a]))
+                                 for t in ts])
+            t = ts[costs.argmin(axis=0)]
+            cost = costs.min(axis=0)
+
+            # each collapse removes up to two triangles. at most about a
+            # third of them go per pass, so later passes see the costs
+            # the earlier collapses left behind
+            want = max((len(tris) - target + 1) // 2, 1)
+            sel = cheap_matching(edges, cost, nv,
+                                 min(want, len(tris) // 6 + 1), rng)
+
+            # drop collapses that would flip a triangle, or can't carry
+            # the split copies across, until none are left
+            stuck = numpy.zeros(nv, dtype=bool)
+            while len(sel):
+                remap = numpy.arange(nv)
+                remap[b[sel]] = a[sel]
+                newpos = pos.copy()
+                newpos[a[sel]] += t[sel, None] * (pos[b[sel]] - pos[a[sel]])
+                moved = numpy.zeros(nv, dtype=bool)
+                moved[a[sel]] = True
+                newptris = remap[ptris]
+                live = proper(newptris)
+                check = live & moved[newptris].any(axis=1)
+                before = tri_normals(pos, ptris[check])
+                after = tri_normals(newpos, newptris[check])
+                # flipped, or squashed to next to nothing
+                dot = numpy.einsum('ij,ij->i', before, after)
+                flipped = dot <= 1e-6 * numpy.einsum('ij,ij->i', before,
+                                                     before)
+                bad = numpy.zeros(nv, dtype=bool)
+                bad[newptris[check][flipped].ravel()] = True
+
+                # in each triangle that goes, the vertex at b becomes
+                # the one at a. copies at b without such a partner stay
+                # as they are, at the new point. a vertex with two
+                # partners would tear a seam, so its collapse waits
+                dv, dp, dn = tris[~live], ptris[~live], newptris[~live]
+                j = numpy.argmax(dn == numpy.roll(dn, -1, axis=1), axis=1)
+                k = (j + 1) % 3
+                r = numpy.arange(len(dv))
+                at_b = (remap[dp[r, j]] != dp[r, j])[:, None]
+                pairs = numpy.stack([dv[r, j], dv[r, k]], axis=1)
+                pairs = numpy.unique(numpy.where(at_b, pairs,
+                                                 pairs[:, ::-1]), axis=0)
+                clash = numpy.zeros(nv, dtype=bool)
+                for col in pairs.T:
+                    u, c = numpy.unique(col, return_counts=True)
+                    clash[u[c > 1]] = True
+                bad[point[pairs[clash[pairs].any(axis=1), 1]]] = True
+                if not bad.any():
+                    break
+                stuck |= bad
+                sel = sel[~bad[a[sel]]]
+            if not len(sel):
+                if stuck.any():
+                    continue
+                break
+
+            # pairs are (vertex at b, vertex at a)
+            tp = numpy.zeros(nv)
+            tp[a[sel]] = t[sel]
+            vb, va = pairs.T
+            tv = tp[point[va], None]
+            n = normal[va] + tv * (normal[vb] - normal[va])
+            normal[va] = n / numpy.maximum(
+                numpy.linalg.norm(n, axis=1), 1e-300)[:, None]
+            uv[va] += tv * (uv[vb] - uv[va])
+            vmap = numpy.arange(nv)
+            vmap[vb] = va
+
+            pos = newpos
+            q[a[sel]] += q[b[sel]]
+            point = remap[point]
+            tris = vmap[tris[live]]
+            ptris = newptris[live]
+            material = material[live]
+
+        # the last few collapses can land a handful over, which is fine
+        if len(tris) > 1.01 * target + 2:
+            warnings.warn('decimate stopped at {} triangles, short of the {} '
+                          'asked for'.format(len(tris), target))
+
+        uses = numpy.bincount(tris.ravel(), minlength=nv)
+        fn = tri_normals(pos, ptris)
+        fn /= numpy.maximum(numpy.linalg.norm(fn, axis=1), 1e-300)[:, None]
+        for j in range(3):
+            flat = faceted[tris[:, j]] & (uses[tris[:, j]] == 1)
+            normal[tris[flat, j]] = fn[flat]
+
+        used = uses > 0
+        remap = numpy.cumsum(used) - 1
+        vertices = numpy.empty(int(used.sum()), dtype=Vertex)
+        vertices['pos'] = pos[point[used]]
+        vertices['normal'] = normal[used]
+        vertices['uv'] = uv[used]
+        triangles = numpy.empty(len(tris), dtype=Triangle)
+        triangles['vs'] = remap[tris]
+        triangles['material'] = material
+        return self.__class__(vertices, triangles, copy=False)
+
+    def optimize_layout(self):
+        # sort triangles along a z-order curve through their centroids,
+        # then number vertices in the order the triangles first use
+        # them, which keeps neighbours close together in the file
+        vs = self.triangles['vs']
+        pos = self.vertices['pos']
+        centroids = (pos[vs[:, 0]].astype(numpy.float64) + pos[vs[:, 1]]
+                     + pos[vs[:, 2]]) / 3
+        if len(centroids):
+            codes = morton_codes(centroids, centroids.min(axis=0),
+                                 centroids.max(axis=0))
+            triangles = self.triangles[numpy.argsort(codes, kind='stable')]
+        else:
+            triangles = self.triangles.copy()
+
+        # unused vertices keep their relative order, at the end
+        used, first = numpy.unique(triangles['vs'].ravel(), return_index=True)
+        unused = numpy.ones(len(self.vertices), dtype=bool)
+        unused[used] = False
+        order = numpy.concatenate([used[numpy.argsort(first)],
+                                   numpy.flatnonzero(unused)])
+        remap = numpy.empty(len(order), dtype=numpy.uint32)
+        remap[order] = numpy.arange(len(order))
+        triangles['vs'] = remap[triangles['vs']]
+        return self.__class__(self.vertices[order], triangles, copy=False)
+
+    def compute_normals(self, mode='area', crease_angle=None):
+        # recompute vertex normals from the faces around each position,
+        # weighted by face area or by corner angle. corners sharing a
+        # position are smoothed across uv seams. with crease_angle (in
+        # degrees), faces only share normals with faces within that
+        # angle of them, and vertices are split along the creases.
+        if mode not in {'area', 'angle'}:
+            raise ValueError('unknown normal mode `{}`'.format(mode))
+        pos = self.vertices['pos'].astype(numpy.float64)
+        vs = self.triangles['vs'].astype(numpy.int64)
+        corner_v = vs.ravel()
+        p = [pos[vs[:, j]] for j in range(3)]
+
+        face = numpy.cross(p[1] - p[0], p[2] - p[0])
+        length = numpy.linalg.norm(face, axis=1)
+        unit = face / numpy.where(length > 0, length, 1)[:, None]
+        if mode == 'area':
+            weight = numpy.repeat(length, 3)
+        else:
+            weight = numpy.empty((len(vs), 3))
+            for j in range(3):
+                e1 = p[(j + 1) % 3] - p[j]
+                e2 = p[(j + 2) % 3] - p[j]
+                weight[:, j] = numpy.arctan2(
+                    numpy.linalg.norm(numpy.cross(e1, e2), axis=1),
+                    numpy.einsum('ij,ij->i', e1, e2))
+            weight = weight.ravel()
+        contrib = numpy.repeat(unit, 3, axis=0) * weight[:, None]
+
+        keys = numpy.zeros(len(pos), dtype=[('pos', numpy.float32, 3)])
+        keys['pos'] = self.vertices['pos']
+        _, pid = weld(keys)
+        cpid = pid[corner_v]
+
+        def normalize(n):
+            length = numpy.linalg.norm(n, axis=1)
+            return n / numpy.where(length > 0, length, 1)[:, None]
+
+        if crease_angle is None:
+            acc = numpy.stack([numpy.bincount(cpid, weights=contrib[:, k],
+                                              minlength=pid.max(initial=-1)
+                                              + 1)
+                               for k in range(3)], axis=-1)
+            vertices = self.vertices.copy()
+            vertices['normal'] = normalize(acc)[pid]
+            return self.__class__(vertices, self.triangles.copy(), copy=False)
+
+        # pair every corner with every corner at the same position, and
+        # keep the pairs that are not across a crease
+        order = numpy.argsort(cpid, kind='stable')
+        spid = cpid[order]
+        lo = numpy.searchsorted(spid, cpid, 'left')
+        count = numpy.searchsorted(spid, cpid, 'right') - lo
+        a = numpy.repeat(numpy.arange(len(cpid)), count)
+        b = order[numpy.repeat(lo, count) + numpy.arange(len(a))
+                  - numpy.repeat(numpy.cumsum(count) - count, count)]
+        cos = numpy.cos(numpy.radians(crease_angle))
+        fa, fb = a // 3, b // 3
+        smooth = numpy.einsum('ij,ij->i', unit[fa], unit[fb]) >= cos
+        a, b = a[smooth], b[smooth]
+        normals = normalize(numpy.stack([
+            numpy.bincount(a, weights=contrib[b, k], minlength=len(cpid))
+            for k in range(3)], axis=-1))
+
+        # split vertices only where their corners disagree
+        keys = numpy.zeros(len(cpid), dtype=[
+            ('v', numpy.int64),
+            ('normal', numpy.float32, 3),
+        ])
+        keys['v'] = corner_v
+        keys['normal'] = normals
+        first, remap = weld(keys)
+        vertices = self.vertices[corner_v[first]]
+        vertices['normal'] = keys['normal'][first]
+        triangles = self.triangles.copy()
+        triangles['vs'] = remap.reshape(-1, 3)
+        return self.__class__(vertices, triangles, copy=False)
+
+    def stats(self, chunk_size=CHUNK):
+        positions = self.vertices['pos']
+        return mesh_stats(
+            (self.vertices[i:i + chunk_size]
+             for i in range(0, len(self.vertices), chunk_size)),
+            len(self.vertices), self.triangles,
+            lambda idx: positions[idx], chunk_size=chunk_size)
+
+    def bounds(self, chunk_size=CHUNK):
+        # (min, max) corners over finite positions, None if there are none
+        lo = numpy.full(3, numpy.inf)
+        hi = numpy.full(3, -numpy.inf)
+        for i in range(0, len(self.vertices), chunk_size):
+            pos = self.vertices['pos'][i:i + chunk_size]
+            pos = pos[numpy.isfinite(pos).all(axis=1)]
+            if len(pos):
+                lo = numpy.minimum(lo, pos.min(axis=0))
+                hi = numpy.maximum(hi, pos.max(axis=0))
+        if numpy.all(lo <= hi):
+            return (lo, hi)
+        return None
+
+    def validate(self, chunk_size=CHUNK):
+        # raises ValueError for meshes Tungsten cannot use, returns stats
+        st = self.stats(chunk_size=chunk_size)
+        if st.out_of_range_indices:
+            raise ValueError('mesh has {} out-of-range vertex indices'
+                             .format(st.out_of_range_indices))
+        if st.nonfinite_vertices:
+            raise ValueError('mesh has {} non-finite vertices'
+                             .format(st.nonfinite_vertices))
+        return st
 
     def dump(self, f):
         f.write(LENFMT.pack(len(self.vertices)))
@@ -48,15 +893,39 @@ class Mesh:
         ])
 
     @classmethod
-    def load(cls, f):
-        nv = LENFMT.unpack(f.read(LENFMT.size))[0]
+    def load(cls, f, workers=None):
+        # workers is only used for compressed files
+        head = f.read(LENFMT.size)
+        if head == ZMAGIC:
+            data = read_compressed(f, f.tell() - len(ZMAGIC), workers=workers)
+            return cls.loadb(data, copy=False)
+        nv = LENFMT.unpack(head)[0]
         vertices = numpy.fromfile(f, dtype=Vertex, count=nv)
         nt = LENFMT.unpack(f.read(LENFMT.size))[0]
         triangles = numpy.fromfile(f, dtype=Triangle, count=nt)
-        return cls(vertices, triangles)
+        return cls(vertices, triangles, copy=False)
 
     @classmethod
-    def loadb(cls, data):
+    def open(cls, path, mode='r'):
+        # memory-map the file, without reading or copying the arrays
+        # mode is as for numpy.memmap: 'r', 'r+' or 'c' (copy-on-write)
+        if mode not in {'r', 'r+', 'c'}:
+            raise ValueError('bad mode `{}` for mesh file'.format(mode))
+        if is_compressed(path):
+            raise ValueError('cannot memory-map compressed mesh file `{}`'
+                             .format(path))
+        with open(path, 'rb') as f:
+            nv, nt, voff, toff = read_header(f)
+        vertices = map_array(path, Vertex, nv, voff, mode=mode)
+        triangles = map_array(path, Triangle, nt, toff, mode=mode)
+        return cls(vertices, triangles, copy=False)
+
+    @classmethod
+    def loadb(cls, data, copy=True):
+        if data[:len(ZMAGIC)] == ZMAGIC:
+            data = read_compressed(io.BytesIO(data), 0)
+            copy = False
+
         c = 0
 
         nv = LENFMT.unpack_from(data, offset=c)[0]
@@ -71,4 +940,1199 @@ class Mesh:
         triangles = numpy.frombuffer(data, dtype=Triangle, count=nt, offset=c)
         c += Triangle.itemsize * nt
 
-        return cls(vertices, triangles)
+        return cls(vertices, triangles, copy=copy)
+
+    def dumpz(self, f, codec='zlib', level=None, chunk_size=ZCHUNK_SIZE,
+              workers=None):
+        # write a compressed .wo3, without building the plain one first
+        parts = [
+            LENFMT.pack(len(self.vertices)),
+            numpy.ascontiguousarray(self.vertices).view(numpy.uint8),
+            LENFMT.pack(len(self.triangles)),
+            numpy.ascontiguousarray(self.triangles).view(numpy.uint8),
+        ]
+        write_compressed(f, rechunk(parts, chunk_size), codec=codec,
+                         level=level, chunk_size=chunk_size, workers=workers)
+
+
+@dataclasses.dataclass
+class CompactMesh:
+    # a Mesh in under half the memory, for batch processing of huge
+    # scenes. positions are quantized to 16 bits across the bounds
+    # (so the error is at most 1/131070 of the extent on each axis),
+    # normals are octahedral in 2x16 bits and uvs are float16.
+    # triangles are kept as they are.
+
+    # dtype = CompactVertex
+    vertices: numpy.ndarray
+    # dtype = Triangle
+    triangles: numpy.recarray
+    # float64 corners of the quantization box
+    lo: numpy.ndarray
+    hi: numpy.ndarray
+    copy: dataclasses.InitVar[bool] = True
+
+    def __post_init__(self, copy):
+        convert = numpy.array if copy else numpy.asarray
+        self.vertices = convert(self.vertices, dtype=CompactVertex)
+        self.triangles = convert(self.triangles, dtype=Triangle) \
+                             .view(numpy.recarray)
+        self.lo = numpy.array(self.lo, dtype=numpy.float64)
+        self.hi = numpy.array(self.hi, dtype=numpy.float64)
+
+    @classmethod
+    def from_mesh(cls, mesh, chunk_size=CHUNK):
+        # the triangles are shared with mesh, not copied
+        nv = len(mesh.vertices)
+        lo = numpy.full(3, numpy.inf)
+        hi = numpy.full(3, -numpy.inf)
+        for i in range(0, nv, chunk_size):
+            pos = mesh.vertices['pos'][i:i + chunk_size]
+            if not numpy.isfinite(pos).all():
+                raise ValueError('cannot quantize non-finite positions')
+            if len(pos):
+                lo = numpy.minimum(lo, pos.min(axis=0))
+                hi = numpy.maximum(hi, pos.max(axis=0))
+        if not nv:
+            lo = hi = numpy.zeros(3)
+
+        out = cls(numpy.empty(nv, dtype=CompactVertex), mesh.triangles,
+                  lo, hi, copy=False)
+        for i in range(0, nv, chunk_size):
+            out.encode(mesh.vertices[i:i + chunk_size], i)
+        return out
+
+    def scale(self):
+        extent = self.hi - self.lo
+        return numpy.where(extent > 0, extent, 1) / 65535
+
+    def encode(self, vertices, start=0):
+        # store Vertex records into self.vertices[start:]
+        out = self.vertices[start:start + len(vertices)]
+        pos = (vertices['pos'] - self.lo) / self.scale()
+        out['pos'] = numpy.clip(numpy.rint(pos), 0, 65535)
+        out['normal'] = encode_octahedral(vertices['normal'])
+        uv = vertices['uv']
+        if numpy.any(numpy.abs(uv) > numpy.finfo(numpy.float16).max):
+            raise ValueError('uvs out of float16 range')
+        out['uv'] = uv
+
+    def positions(self, idx=slice(None)):
+        pos = self.vertices['pos'][idx].astype(numpy.float64)
+        return (pos * self.scale() + self.lo).astype(numpy.float32)
+
+    def decode(self, start=0, stop=None):
+        # self.vertices[start:stop] as Vertex records
+        v = self.vertices[start:stop]
+        out = numpy.empty(len(v), dtype=Vertex)
+        out['pos'] = self.positions(slice(start, stop))
+        out['normal'] = decode_octahedral(v['normal'])
+        out['uv'] = v['uv']
+        return out.view(numpy.recarray)
+
+    def chunks(self, chunk_size=CHUNK):
+        for i in range(0, len(self.vertices), chunk_size):
+            yield self.decode(i, i + chunk_size)
+
+    def to_mesh(self, chunk_size=CHUNK):
+        vertices = numpy.empty(len(self.vertices), dtype=Vertex)
+        for i in range(0, len(vertices), chunk_size):
+            vertices[i:i + chunk_size] = self.decode(i, i + chunk_size)
+        return Mesh(vertices, self.triangles.copy(), copy=False)
+
+    def stats(self, chunk_size=CHUNK):
+        return mesh_stats(self.chunks(chunk_size), len(self.vertices),
+                          self.triangles, self.positions,
+                          chunk_size=chunk_size)
+
+    def dump(self, f, chunk_size=CHUNK):
+        # writes a plain .wo3, decoding a chunk at a time
+        f.write(LENFMT.pack(len(self.vertices)))
+        for v in self.chunks(chunk_size):
+            f.write(v.tobytes())
+        f.write(LENFMT.pack(len(self.triangles)))
+        f.write(self.triangles.tobytes())
+
+
+def rechunk(parts, size):
+    # turn a sequence of buffers into buffers of exactly size bytes,
+    # except the last, copying only where a chunk spans two parts
+    buf = bytearray()
+    for part in parts:
+        part = memoryview(part).cast('B')
+        while len(part):
+            if not buf and len(part) >= size:
+                yield part[:size]
+                part = part[size:]
+                continue
+            take = size - len(buf)
+            buf += part[:take]
+            part = part[take:]
+            if len(buf) == size:
+                yield bytes(buf)
+                buf.clear()
+    if buf:
+        yield bytes(buf)
+
+
+def ordered_map(fn, items, workers=None, window=None):
+    # like Executor.map, but never runs more than window items ahead
+    # of the consumer, which keeps memory bounded on huge inputs
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if window is None:
+        window = 2 * workers
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def get_codec(codec):
+    try:
+        return CODECS[codec]
+    except KeyError:
+        raise ValueError('unknown codec `{}`'.format(codec)) from None
+
+
+def get_decompressor(codec_id):
+    for cid, _, decomp in CODECS.values():
+        if cid == codec_id:
+            return decomp
+    raise ValueError('unknown codec id {}'.format(codec_id))
+
+
+def write_compressed(f, chunks, codec='zlib', level=None,
+                     chunk_size=ZCHUNK_SIZE, workers=None):
+    # chunks are the plain .wo3 contents, each chunk_size bytes long
+    # except the last
+    codec_id, comp, _ = get_codec(codec)
+    start = f.tell()
+    f.write(ZMAGIC)
+    f.write(ZHEADER.pack(ZVERSION, codec_id, chunk_size))
+    locator = f.tell()
+    f.write(ZLOCATOR.pack(0))
+    index = []
+    raw_size = 0
+
+    def work(chunk):
+        return (len(chunk), comp(chunk, level))
+
+    for n, data in ordered_map(work, chunks, workers=workers):
+        index.append(ZINDEX.pack(f.tell() - start, len(data)))
+        f.write(data)
+        raw_size += n
+
+    index_offset = f.tell() - start
+    f.write(b''.join(index))
+    trailer_offset = f.tell() - start
+    f.write(ZTRAILER.pack(index_offset, len(index), raw_size))
+    # the locator goes in once the trailer's place is known
+    end = f.tell()
+    f.seek(locator)
+    f.write(ZLOCATOR.pack(trailer_offset))
+    f.seek(end)
+
+
+def read_compressed_index(f, start):
+    # returns (decompress, chunk size, uncompressed size,
+    #          [(offset, compressed size)], end of the compressed mesh)
+    f.seek(start + len(ZMAGIC))
+    header = f.read(ZHEADER.size)
+    if len(header) != ZHEADER.size:
+        raise ValueError('truncated compressed mesh file')
+    version, codec_id, chunk_size = ZHEADER.unpack(header)
+    if version not in {1, ZVERSION}:
+        raise ValueError('unsupported compressed mesh version {}'
+                         .format(version))
+    decomp = get_decompressor(codec_id)
+
+    if version == 1:
+        trailer_offset = f.seek(0, 2) - ZTRAILER.size - start
+    else:
+        locator = f.read(ZLOCATOR.size)
+        if len(locator) != ZLOCATOR.size:
+            raise ValueError('truncated compressed mesh file')
+        trailer_offset = ZLOCATOR.unpack(locator)[0]
+    if not 0 <= trailer_offset <= f.seek(0, 2) - ZTRAILER.size - start:
+        raise ValueError('truncated compressed mesh file')
+    f.seek(start + trailer_offset)
+    index_offset, count, raw_size = ZTRAILER.unpack(f.read(ZTRAILER.size))
+    # the index sits right before the trailer, after all the chunks
+    if index_offset + ZINDEX.size * count != trailer_offset:
+        raise ValueError('corrupt compressed mesh file')
+    f.seek(start + index_offset)
+    index = list(ZINDEX.iter_unpack(f.read(ZINDEX.size * count)))
+    if any(offset + size > index_offset for offset, size in index):
+        raise ValueError('corrupt compressed mesh file')
+    end = start + trailer_offset + ZTRAILER.size
+    f.seek(end)
+    return (decomp, chunk_size, raw_size, index, end)
+
+
+def iter_compressed(f, start, workers=None):
+    # yields the decompressed chunks of a compressed .wo3, in order
+    decomp, chunk_size, raw_size, index, _ = read_compressed_index(f, start)
+
+    def chunks():
+        for offset, size in index:
+            f.seek(start + offset)
+            yield f.read(size)
+
+    return ordered_map(decomp, chunks(), workers=workers)
+
+
+def read_compressed(f, start, workers=None):
+    # leaves f after the compressed mesh
+    decomp, chunk_size, raw_size, index, end = \
+        read_compressed_index(f, start)
+    data = bytearray(raw_size)
+    view = memoryview(data)
+    offset = 0
+    for chunk in iter_compressed(f, start, workers=workers):
+        view[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    if offset != raw_size:
+        raise ValueError('corrupt compressed mesh file')
+    f.seek(end)
+    return data
+
+
+def is_compressed(path):
+    with open(path, 'rb') as f:
+        return f.read(len(ZMAGIC)) == ZMAGIC
+
+
+def compress(src, dst, codec='zlib', level=None, chunk_size=ZCHUNK_SIZE,
+             workers=None):
+    # compress a plain .wo3 file into a compressed one, by path
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        chunks = iter(lambda: fin.read(chunk_size), b'')
+        write_compressed(fout, chunks, codec=codec, level=level,
+                         chunk_size=chunk_size, workers=workers)
+
+
+def decompress(src, dst, workers=None):
+    # expand a compressed .wo3 file back into one Tungsten can read
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        if fin.read(len(ZMAGIC)) != ZMAGIC:
+            raise ValueError('`{}` is not a compressed mesh file'
+                             .format(src))
+        for chunk in iter_compressed(fin, 0, workers=workers):
+            fout.write(chunk)
+
+
+def read_counts(path):
+    # (vertex count, triangle count) of a plain or compressed .wo3,
+    # reading only the lengths, or the chunks holding them
+    with open(path, 'rb') as f:
+        head = f.read(LENFMT.size)
+        if head != ZMAGIC:
+            f.seek(0)
+            nv, nt, _, _ = read_header(f)
+            return (nv, nt)
+        decomp, chunk_size, raw_size, index, _ = read_compressed_index(f, 0)
+
+        def read(offset, size):
+            first = offset // chunk_size
+            last = (offset + size - 1) // chunk_size
+            if last >= len(index):
+                raise ValueError('truncated mesh file')
+            parts = []
+            for chunk_offset, chunk_len in index[first:last + 1]:
+                f.seek(chunk_offset)
+                parts.append(decomp(f.read(chunk_len)))
+            data = b''.join(parts)
+            start = offset - first * chunk_size
+            return LENFMT.unpack(data[start:start + size])[0]
+
+        nv = read(0, LENFMT.size)
+        nt = read(LENFMT.size + Vertex.itemsize * nv, LENFMT.size)
+        return (nv, nt)
+
+
+def loaded_size(path):
+    # bytes a plain load of path will hold in memory
+    with open(path, 'rb') as f:
+        if f.read(len(ZMAGIC)) != ZMAGIC:
+            return os.fstat(f.fileno()).st_size
+        return read_compressed_index(f, 0)[2]
+
+
+def load_path(path):
+    with open(path, 'rb') as f:
+        # files are already loaded in parallel, so don't nest pools
+        return Mesh.load(f, workers=1)
+
+
+def load_many(paths, workers=None, max_bytes=1 << 30, headers_only=False):
+    # yields a Mesh for each path, in order, loading ahead on a thread
+    # pool. loaded but unconsumed meshes are kept under max_bytes,
+    # except that one is always let through however large it is.
+    # with headers_only, yields (vertex count, triangle count) instead
+    if headers_only:
+        return ordered_map(read_counts, paths, workers=workers)
+    return load_ahead(paths, workers, max_bytes)
+
+
+def load_ahead(paths, workers, max_bytes):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    window = 2 * workers
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        pending = collections.deque()
+        in_flight = 0
+        for path in paths:
+            size = loaded_size(path)
+            while pending and (len(pending) >= window
+                               or in_flight + size > max_bytes):
+                fut, n = pending.popleft()
+                in_flight -= n
+                yield fut.result()
+            pending.append((pool.submit(load_path, path), size))
+            in_flight += size
+        while pending:
+            yield pending.popleft()[0].result()
+
+
+def faces_mesh(centers, us, vs):
+    # one flat unit square per face, centered on centers with edges
+    # along us and vs. us x vs is the front, and uvs follow the edges
+    corners = numpy.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) / 2
+    n = len(centers)
+    vertices = numpy.zeros(4 * n, dtype=Vertex)
+    vertices['pos'] = (centers[:, None] +
+                       corners[None, :, :1] * us[:, None] +
+                       corners[None, :, 1:] * vs[:, None]).reshape(-1, 3)
+    vertices['normal'] = numpy.repeat(numpy.cross(us, vs), 4, axis=0)
+    vertices['uv'] = numpy.tile(corners + 0.5, (n, 1))
+    triangles = numpy.zeros(2 * n, dtype=Triangle)
+    start = 4 * numpy.arange(n)[:, None]
+    triangles['vs'] = numpy.concatenate(
+        [start + [0, 1, 2], start + [0, 2, 3]], axis=1).reshape(-1, 3)
+    return Mesh(vertices, triangles, copy=False)
+
+
+def quad():
+    # Tungsten's quad, before its transform: the unit square in the xz
+    # plane around the origin, facing +y, with u along x and v along z
+    eye = numpy.eye(3)
+    mesh = faces_mesh(numpy.zeros((1, 3)), eye[None, 2], eye[None, 0])
+    mesh.vertices['uv'] = mesh.vertices['pos'][:, ::2] + 0.5
+    return mesh
+
+
+def cube():
+    # Tungsten's cube, before its transform: the unit cube around the
+    # origin, facing out. faces across axis i have u and v along the
+    # next two axes
+    eye = numpy.eye(3)
+    us = numpy.concatenate([numpy.roll(eye, -1, axis=0),
+                            numpy.roll(eye, 1, axis=0)])
+    vs = numpy.concatenate([numpy.roll(eye, 1, axis=0),
+                            numpy.roll(eye, -1, axis=0)])
+    mesh = faces_mesh(numpy.concatenate([eye, -eye]) / 2, us, vs)
+    axis = numpy.repeat(numpy.arange(6) % 3, 4)[:, None]
+    mesh.vertices['uv'] = numpy.take_along_axis(
+        mesh.vertices['pos'], (axis + [1, 2]) % 3, axis=1) + 0.5
+    return mesh
+
+
+def merge(meshes, transforms=None, material_offsets=None,
+          chunk_size=CHUNK):
+    # concatenate meshes (or CompactMeshes) into one, baking in
+    # per-mesh transforms (4x4 matrices, or anything with one as .m,
+    # like scene.Transform) and adding material_offsets to each mesh's
+    # material ids
+    meshes = list(meshes)
+    nvs = numpy.array([len(m.vertices) for m in meshes], dtype=numpy.int64)
+    nts = numpy.array([len(m.triangles) for m in meshes], dtype=numpy.int64)
+    vertices = numpy.empty(int(nvs.sum()), dtype=Vertex)
+    triangles = numpy.empty(int(nts.sum()), dtype=Triangle)
+    if not meshes:
+        return Mesh(vertices, triangles, copy=False)
+    offset = 0
+    for m in meshes:
+        # compact meshes are decoded straight into the output
+        n = len(m.vertices)
+        for i in range(0, n, chunk_size):
+            part = m.vertices[i:i + chunk_size] \
+                if isinstance(m, Mesh) else m.decode(i, i + chunk_size)
+            vertices[offset + i:offset + i + len(part)] = part
+        offset += n
+    numpy.concatenate([m.triangles for m in meshes], out=triangles)
+
+    triangles['vs'] += numpy.repeat(numpy.cumsum(nvs) - nvs,
+                                    nts).astype(numpy.uint32)[:, None]
+    if material_offsets is not None:
+        triangles['material'] += numpy.repeat(
+            numpy.asarray(material_offsets, dtype=numpy.int32), nts)
+
+    if transforms is not None:
+        m = numpy.array([getattr(t, 'm', t) for t in transforms],
+                        dtype=numpy.float64)
+        if m.shape != (len(meshes), 4, 4):
+            raise ValueError('need one 4x4 transform per mesh')
+        linear = m[:, :3, :3]
+        offset = m[:, :3, 3]
+        # normals transform by the inverse transpose
+        normal = numpy.linalg.inv(linear).transpose(0, 2, 1)
+        ids = numpy.repeat(numpy.arange(len(meshes)), nvs)
+        for i in range(0, len(vertices), chunk_size):
+            v = vertices[i:i + chunk_size]
+            idx = ids[i:i + chunk_size]
+            v['pos'] = numpy.einsum('nij,nj->ni', linear[idx], v['pos']) \
+                + offset[idx]
+            n = numpy.einsum('nij,nj->ni', normal[idx], v['normal'])
+            length = numpy.linalg.norm(n, axis=1)
+            v['normal'] = n / numpy.where(length > 0, length, 1)[:, None]
+
+    return Mesh(vertices, triangles, copy=False)
+
+
+def from_vertex_faces(positions, normals, uvs, corners, face_sizes,
+                      material_ids=None):
+    # meshes whose normals and uvs are per-vertex, as in PLY files
+    # without normals, smooth ones are computed
+    corners = numpy.asarray(corners, dtype=numpy.int64)
+    mesh = Mesh.from_corners(
+        positions, None if normals is None else normals[corners],
+        None if uvs is None else uvs[corners], corners, face_sizes,
+        material_ids)
+    if normals is None:
+        mesh = mesh.compute_normals()
+    return mesh
+
+
+def split_floats(lines, width):
+    # parse whitespace-separated numbers, width per line, ignoring extras
+    values = b' '.join(lines).split()
+    if len(values) == width * len(lines):
+        return numpy.array(values, dtype=numpy.float64).reshape(-1, width)
+    return numpy.array([l.split()[:width] for l in lines],
+                       dtype=numpy.float64).reshape(-1, width)
+
+
+def load_obj(path, materials=None, chunk_size=1 << 24):
+    # read a Wavefront OBJ file, a chunk of lines at a time so that
+    # parsing memory stays bounded. material ids count up in order of
+    # first usemtl, and if materials is a list their names are added
+    positions, uvs, normals = [], [], []
+    corners, face_sizes, face_materials = [], [], []
+    counts = numpy.zeros(3, dtype=numpy.int64)
+    material_ids = {}
+    current = 0
+
+    def chunks(f):
+        rest = b''
+        for block in iter(lambda: f.read(chunk_size), b''):
+            block = rest + block
+            end = block.rfind(b'\n') + 1
+            rest = block[end:]
+            if end:
+                yield block[:end].split(b'\n')
+        if rest:
+            yield [rest]
+
+    with open(path, 'rb') as f:
+        for lines in chunks(f):
+            # the keyword, and the rest of the line after any whitespace
+            lines = [l.split(None, 1) or [b''] for l in lines]
+            kind = numpy.array([l[0] for l in lines], dtype=bytes)
+            lines = [l[1] if len(l) > 1 else b'' for l in lines]
+            # vertex counts before every line, for relative indices
+            seen = [counts[i] + numpy.cumsum(kind == k)
+                    for i, k in enumerate([b'v', b'vt', b'vn'])]
+
+            for i, (k, out, width) in enumerate([(b'v', positions, 3),
+                                                 (b'vt', uvs, 2),
+                                                 (b'vn', normals, 3)]):
+                sel = numpy.flatnonzero(kind == k)
+                if len(sel):
+                    out.append(split_floats([lines[j] for j in sel],
+                                            width))
+                    counts[i] += len(sel)
+
+            # material of every line, from the last usemtl before it
+            usemtl = numpy.flatnonzero(kind == b'usemtl')
+            ids = numpy.full(len(usemtl) + 1, current)
+            for n, j in enumerate(usemtl):
+                name = lines[j].strip().decode('utf-8', 'replace')
+                if name not in material_ids:
+                    material_ids[name] = len(material_ids)
+                ids[n + 1] = material_ids[name]
+            current = ids[-1]
+
+            sel = numpy.flatnonzero(kind == b'f')
+            if not len(sel):
+                continue
+            faces = [lines[j].split() for j in sel]
+            sizes = numpy.array([len(t) for t in faces], dtype=numpy.int64)
+            tokens = [t for face in faces for t in face]
+            parts = tokens[0].count(b'/') + 1
+            text = b' '.join(tokens).replace(b'//', b'/0/').replace(b'/', b' ')
+            idx = numpy.array(text.split(), dtype=numpy.int64)
+            if len(idx) != parts * len(tokens):
+                raise ValueError('mixed face formats in `{}`'.format(path))
+            idx = numpy.pad(idx.reshape(-1, parts), ((0, 0), (0, 3 - parts)))
+            for i in range(3):
+                base = numpy.repeat(seen[i][sel], sizes)
+                # 1-based, negative is relative, 0 is missing (-1)
+                idx[:, i] = numpy.where(idx[:, i] < 0, idx[:, i] + base,
+                                        idx[:, i] - 1)
+            corners.append(idx)
+            face_sizes.append(sizes)
+            face_materials.append(ids[numpy.searchsorted(usemtl, sel)])
+
+    if materials is not None:
+        materials.extend(material_ids)
+
+    def cat(arrays, shape, dtype):
+        if arrays:
+            return numpy.concatenate(arrays)
+        return numpy.zeros(shape, dtype=dtype)
+
+    positions = cat(positions, (0, 3), numpy.float64)
+    uvs = cat(uvs, (0, 2), numpy.float64)
+    normals = cat(normals, (0, 3), numpy.float64)
+    corners = cat(corners, (0, 3), numpy.int64)
+    face_sizes = cat(face_sizes, (0,), numpy.int64)
+    face_materials = cat(face_materials, (0,), numpy.int64)
+    # bad indices would otherwise fail later, with less to go on
+    for i, (name, values) in enumerate([('vertex', positions),
+                                        ('uv', uvs), ('normal', normals)]):
+        # only positions can't be missing (-1)
+        bad = (corners[:, i] < (-1 if i else 0)) | \
+            (corners[:, i] >= len(values))
+        if bad.any():
+            raise ValueError('face uses {} {} of {} in `{}`'.format(
+                name, corners[bad, i][0] + 1, len(values), path))
+
+    corner_uvs = None
+    has_uv = corners[:, 1] >= 0
+    if has_uv.any():
+        corner_uvs = numpy.zeros((len(corners), 2))
+        corner_uvs[has_uv] = uvs[corners[has_uv, 1]]
+    corner_normals = None
+    if len(corners) and (corners[:, 2] >= 0).all():
+        corner_normals = normals[corners[:, 2]]
+    mesh = Mesh.from_corners(positions, corner_normals, corner_uvs,
+                             corners[:, 0], face_sizes, face_materials)
+    if corner_normals is None:
+        mesh = mesh.compute_normals()
+    return mesh
+
+
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+
+
+def read_ply_header(f):
+    # returns (format, [(element, count, [(property, type)])]), where
+    # type is a numpy type string, or (count type, item type) for lists
+    if f.readline().strip() != b'ply':
+        raise ValueError('not a PLY file')
+    fmt = None
+    elements = []
+    for line in iter(f.readline, b''):
+        words = line.decode('ascii', 'replace').split()
+        if not words or words[0] in {'comment', 'obj_info'}:
+            continue
+        if words[0] == 'end_header':
+            return (fmt, elements)
+        try:
+            if words[0] == 'format':
+                fmt = words[1]
+            elif words[0] == 'element':
+                elements.append((words[1], int(words[2]), []))
+            elif words[0] == 'property' and words[1] == 'list':
+                elements[-1][2].append((words[4], (PLY_TYPES[words[2]],
+                                                   PLY_TYPES[words[3]])))
+            elif words[0] == 'property':
+                elements[-1][2].append((words[2], PLY_TYPES[words[1]]))
+        except (IndexError, KeyError, ValueError):
+            raise ValueError('bad PLY header line `{}`'
+                             .format(line.strip())) from None
+    raise ValueError('truncated PLY header')
+
+
+def read_ply_element(data, offset, count, props, order):
+    # returns ({property: array}, offset after the element). list
+    # properties come back as (sizes, flat items). records are viewed
+    # in place; runs of lists with the same length are read together.
+    def record(k):
+        fields = []
+        for name, ty in props:
+            if isinstance(ty, tuple):
+                fields.append((name + '.n', order + ty[0]))
+                if k:
+                    fields.append((name, order + ty[1], (k,)))
+            else:
+                fields.append((name, order + ty))
+        return numpy.dtype(fields)
+
+    lists = [(name, ty) for name, ty in props if isinstance(ty, tuple)]
+    if len(lists) > 1:
+        raise ValueError('PLY elements with several lists are unsupported')
+    if not lists:
+        dt = record(0)
+        arr = numpy.frombuffer(data, dtype=dt, count=count, offset=offset)
+        return ({name: arr[name] for name in dt.names},
+                offset + dt.itemsize * count)
+
+    name, (cty, _) = lists[0]
+    before = record(0).fields[name + '.n'][1]
+    runs = []
+    done = 0
+    # views start small and double while a run goes on, so short runs
+    # (like alternating triangles and quads) don't each scan a CHUNK
+    size = 16
+    dtypes = {}
+    while done < count:
+        k = int(numpy.frombuffer(data, dtype=order + cty, count=1,
+                                 offset=offset + before)[0])
+        if k not in dtypes:
+            dtypes[k] = record(k)
+        dt = dtypes[k]
+        n = min(count - done, size, (len(data) - offset) // dt.itemsize)
+        if n <= 0:
+            raise ValueError('truncated PLY file')
+        arr = numpy.frombuffer(data, dtype=dt, count=n, offset=offset)
+        other = numpy.flatnonzero(arr[name + '.n'] != k)
+        if len(other):
+            n = other[0]
+            size = 16
+        else:
+            size = min(2 * size, CHUNK)
+        runs.append((k, arr[:n]))
+        done += n
+        offset += dt.itemsize * n
+
+    out = {}
+    for prop, ty in props:
+        if isinstance(ty, tuple):
+            out[prop] = (
+                numpy.concatenate([numpy.full(len(a), k) for k, a in runs]),
+                numpy.concatenate([a[prop].ravel() if k else
+                                   numpy.zeros(0, dtype=order + ty[1])
+                                   for k, a in runs]))
+        else:
+            out[prop] = numpy.concatenate([a[prop] for _, a in runs])
+    return (out, offset)
+
+
+def read_ply_ascii(f, count, props):
+    out = {name: [] for name, _ in props}
+    for _ in range(count):
+        words = f.readline().split()
+        for name, ty in props:
+            if isinstance(ty, tuple):
+                n = int(words[0])
+                out[name].append(words[1:n + 1])
+                words = words[n + 1:]
+            else:
+                out[name].append(words[0])
+                words = words[1:]
+    for name, ty in props:
+        if isinstance(ty, tuple):
+            items = out[name]
+            out[name] = (numpy.array([len(i) for i in items]),
+                         numpy.array([w for i in items for w in i],
+                                     dtype=ty[1]))
+        else:
+            out[name] = numpy.array(out[name], dtype=ty)
+    return out
+
+
+def load_ply(path):
+    # read a PLY file. binary vertex and face data is used in place,
+    # straight out of a memory map.
+    with open(path, 'rb') as f:
+        fmt, elements = read_ply_header(f)
+        offset = f.tell()
+        values = {}
+        if fmt == 'ascii':
+            for name, count, props in elements:
+                values[name] = read_ply_ascii(f, count, props)
+
+    if fmt in {'binary_little_endian', 'binary_big_endian'}:
+        order = '<' if fmt == 'binary_little_endian' else '>'
+        data = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+        for name, count, props in elements:
+            values[name], offset = read_ply_element(data, offset, count,
+                                                    props, order)
+    elif fmt != 'ascii':
+        raise ValueError('unknown PLY format `{}`'.format(fmt))
+
+    vertex = values.get('vertex', {})
+    face = values.get('face', {})
+    if not all(k in vertex for k in 'xyz'):
+        raise ValueError('PLY file has no vertex positions')
+
+    def columns(*names):
+        for group in names:
+            if all(n in vertex for n in group):
+                return numpy.stack([vertex[n] for n in group], axis=-1)
+        return None
+
+    positions = columns('xyz')
+    normals = columns(('nx', 'ny', 'nz'))
+    uvs = columns('uv', 'st', ('texture_u', 'texture_v'),
+                  ('texture_s', 'texture_t'))
+    lists = face.get('vertex_indices', face.get('vertex_index'))
+    if lists is None:
+        face_sizes = numpy.zeros(0, dtype=numpy.int64)
+        corners = numpy.zeros(0, dtype=numpy.int64)
+    else:
+        face_sizes, corners = lists
+    return from_vertex_faces(positions, normals, uvs, corners, face_sizes,
+                             face.get('material_index'))
+
+
+class MeshWriter:
+    # writes a .wo3 file chunk by chunk, so the whole mesh never has to
+    # be in memory. vertices go straight to the file, triangles are
+    # spooled to a temporary file next to it and appended on close.
+    # the count headers are patched in at the end.
+
+    def __init__(self, f):
+        if isinstance(f, (str, bytes, os.PathLike)):
+            self.f = open(f, 'wb')
+            self.owned = True
+            tmpdir = os.path.dirname(os.path.abspath(f))
+        else:
+            self.f = f
+            self.owned = False
+            tmpdir = None
+        self.start = self.f.tell()
+        self.tris = tempfile.TemporaryFile(dir=tmpdir)
+        self.vertex_count = 0
+        self.triangle_count = 0
+        self.closed = False
+        self.f.write(LENFMT.pack(0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ty, exc, tb):
+        if ty is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write_vertices(self, vertices):
+        # returns the index of the first vertex written
+        vertices = numpy.asarray(vertices, dtype=Vertex)
+        base = self.vertex_count
+        self.f.write(vertices.tobytes())
+        self.vertex_count += len(vertices)
+        return base
+
+    def write_triangles(self, triangles, offset=0):
+        # offset is added to the vertex indices, as returned by
+        # write_vertices
+        triangles = numpy.asarray(triangles, dtype=Triangle)
+        if offset:
+            triangles = triangles.copy()
+            triangles['vs'] += offset
+        self.tris.write(triangles.tobytes())
+        self.triangle_count += len(triangles)
+
+    def write(self, mesh):
+        # append a whole mesh, with its indices shifted to match
+        base = self.write_vertices(mesh.vertices)
+        self.write_triangles(mesh.triangles, offset=base)
+        return base
+
+    def close(self):
+        if self.closed:
+            return
+        self.f.write(LENFMT.pack(self.triangle_count))
+        self.tris.seek(0)
+        shutil.copyfileobj(self.tris, self.f)
+        end = self.f.tell()
+        self.f.seek(self.start)
+        self.f.write(LENFMT.pack(self.vertex_count))
+        self.f.seek(end)
+        self.abort()
+
+    def abort(self):
+        # stop writing, without finishing the file
+        self.closed = True
+        self.tris.close()
+        if self.owned:
+            self.f.close()
+
+
+class MeshArchiveWriter:
+    # packs many meshes into one file, with an index at the end
+
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.index = {}
+        self.f.write(AMAGIC)
+        self.f.write(AHEADER.pack(0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ty, exc, tb):
+        self.close()
+
+    def begin(self, name, nv, nt):
+        if name in self.index:
+            raise KeyError('mesh `{}` is already in the archive'.format(name))
+        offset = self.f.tell()
+        self.f.write(b'\0' * (-offset % AALIGN))
+        self.index[name] = (self.f.tell(), nv, nt)
+
+    def add(self, name, mesh):
+        self.begin(name, len(mesh.vertices), len(mesh.triangles))
+        mesh.dump(self.f)
+
+    def add_file(self, name, path):
+        # copy in a plain .wo3 file, without loading it
+        with open(path, 'rb') as src:
+            nv, nt, _, _ = read_header(src)
+            src.seek(0)
+            self.begin(name, nv, nt)
+            shutil.copyfileobj(src, self.f)
+
+    def close(self):
+        if self.f.closed:
+            return
+        index_offset = self.f.tell()
+        for name, (offset, nv, nt) in self.index.items():
+            name = name.encode('utf-8')
+            self.f.write(AENTRY.pack(offset, nv, nt, len(name)))
+            self.f.write(name)
+        self.f.seek(len(AMAGIC))
+        self.f.write(AHEADER.pack(index_offset, len(self.index)))
+        self.f.close()
+
+
+class MeshArchive:
+    # random access to the meshes in an archive, by name
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        with open(path, 'rb') as f:
+            if f.read(len(AMAGIC)) != AMAGIC:
+                raise ValueError('`{}` is not a mesh archive'.format(path))
+            index_offset, count = AHEADER.unpack(f.read(AHEADER.size))
+            f.seek(index_offset)
+            for _ in range(count):
+                entry = f.read(AENTRY.size)
+                if len(entry) != AENTRY.size:
+                    raise ValueError('truncated mesh archive')
+                offset, nv, nt, n = AENTRY.unpack(entry)
+                self.index[f.read(n).decode('utf-8')] = (offset, nv, nt)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        return self.open(name)
+
+    def size(self, name):
+        # size in bytes of the member as a plain .wo3 file
+        _, nv, nt = self.index[name]
+        return 2 * LENFMT.size + Vertex.itemsize * nv + Triangle.itemsize * nt
+
+    def open(self, name, mode='r'):
+        # memory-map one mesh out of the archive, like Mesh.open
+        offset, nv, nt = self.index[name]
+        voff = offset + LENFMT.size
+        toff = voff + Vertex.itemsize * nv + LENFMT.size
+        return Mesh(map_array(self.path, Vertex, nv, voff, mode=mode),
+                    map_array(self.path, Triangle, nt, toff, mode=mode),
+                    copy=False)
+
+    def extract(self, name, dst):
+        # write one member out as a plain .wo3 file
+        offset = self.index[name][0]
+        with open(self.path, 'rb') as src, open(dst, 'wb') as f:
+            src.seek(offset)
+            remaining = self.size(name)
+            while remaining:
+                data = src.read(min(remaining, ZCHUNK_SIZE))
+                if not data:
+                    raise ValueError('truncated mesh archive')
+                f.write(data)
+                remaining -= len(data)
+
+    def extract_all(self, directory):
+        # members become directory/name, with .wo3 added if needed
+        paths = []
+        for name in self.index:
+            rel = os.path.normpath(name)
+            if os.path.isabs(rel) or rel.split(os.sep)[0] == os.pardir:
+                raise ValueError('unsafe mesh name `{}`'.format(name))
+            if not rel.endswith('.wo3'):
+                rel += '.wo3'
+            dst = os.path.join(directory, rel)
+            os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+            self.extract(name, dst)
+            paths.append(dst)
+        return paths
+
+
+class MeshCache:
+    # a directory of meshes named by a hash of their contents, so
+    # storing the same geometry again costs one hash and no writes.
+    # past max_size bytes, the least recently stored files are evicted.
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def digest(mesh, chunk_size=CHUNK):
+        h = hashlib.blake2b(digest_size=20)
+        for arr in [mesh.vertices, mesh.triangles]:
+            h.update(LENFMT.pack(len(arr)))
+            # hashlib drops the GIL on large updates
+            for i in range(0, len(arr), chunk_size):
+                h.update(numpy.ascontiguousarray(arr[i:i + chunk_size])
+                         .view(numpy.uint8))
+        return h.hexdigest()
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest + '.wo3')
+
+    def store(self, mesh):
+        # returns the absolute path of the cached file
+        return self.derive(mesh, None, None)
+
+    def derive(self, mesh, tag, fn):
+        # like store(fn(mesh)), but cached under mesh's digest and tag,
+        # which should name fn and its arguments, so fn only runs the
+        # first time. returns the absolute path of the cached file.
+        digest = self.digest(mesh)
+        if tag is not None:
+            digest = '{}-{}'.format(digest, tag)
+        path = os.path.abspath(self.path(digest))
+        if os.path.exists(path):
+            # mark as recently used
+            os.utime(path)
+            return path
+
+        if fn is not None:
+            mesh = fn(mesh)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                mesh.dump(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        if self.max_size is None:
+            return
+        entries = []
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith('.wo3') and e.is_file():
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            if os.path.abspath(path) == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def animated_bits(mesh, normals):
+    # the animated part of a frame as (vertex count, 3 or 6) uint32
+    v = mesh.vertices
+    if not normals:
+        return numpy.ascontiguousarray(v['pos']).view(numpy.uint32)
+    bits = numpy.empty((len(v), 6), dtype=numpy.float32)
+    bits[:, :3] = v['pos']
+    bits[:, 3:] = v['normal']
+    return bits.view(numpy.uint32)
+
+
+def shuffle_bytes(bits):
+    # byte planes compress far better than interleaved floats, since
+    # the high bytes of nearby values mostly match
+    return numpy.ascontiguousarray(bits.reshape(-1).view(numpy.uint8)
+                                   .reshape(-1, 4).T).tobytes()
+
+
+def unshuffle_bytes(data, shape):
+    planes = numpy.frombuffer(data, dtype=numpy.uint8).reshape(4, -1)
+    return numpy.ascontiguousarray(planes.T).view(numpy.uint32) \
+                .reshape(shape)
+
+
+class MeshSequenceWriter:
+    # writes frames of a mesh whose topology never changes. every
+    # keyframe_interval-th frame is stored whole, so reading any frame
+    # decodes at most that many.
+
+    def __init__(self, path, codec='zlib', level=None, keyframe_interval=16,
+                 normals=False):
+        if keyframe_interval < 1:
+            raise ValueError('keyframe interval must be at least 1')
+        self.codec_id, self.comp, _ = get_codec(codec)
+        self.level = level
+        self.keyframe_interval = keyframe_interval
+        self.normals = normals
+        self.f = open(path, 'wb')
+        self.f.write(SMAGIC)
+        self.f.write(SHEADER.pack(0, 0, 0, 0, 0, 0, 0, 0))
+        self.topology = None
+        self.previous = None
+        self.index = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ty, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return max(len(self.index) - 1, 0)
+
+    def write_block(self, data):
+        offset = self.f.tell()
+        data = self.comp(data, self.level)
+        self.f.write(data)
+        self.index.append((offset, len(data)))
+
+    def add_frame(self, mesh):
+        # the first frame's triangles, uvs and (without normals=True)
+        # normals are used for every frame
+        if self.topology is None:
+            self.topology = mesh.triangles.copy()
+            self.write_block(mesh.dumpb())
+            self.vertex_count = len(mesh.vertices)
+        elif len(mesh.vertices) != self.vertex_count or \
+                not numpy.array_equal(mesh.triangles, self.topology):
+            raise ValueError('mesh topology changed in frame {}'
+                             .format(len(self)))
+
+        bits = animated_bits(mesh, self.normals)
+        if len(self) % self.keyframe_interval:
+            self.write_block(shuffle_bytes(bits ^ self.previous))
+        else:
+            self.write_block(shuffle_bytes(bits))
+        self.previous = bits.copy()
+
+    def close(self):
+        if self.f.closed:
+            return
+        index_offset = self.f.tell()
+        for entry in self.index:
+            self.f.write(SENTRY.pack(*entry))
+        self.f.seek(len(SMAGIC))
+        self.f.write(SHEADER.pack(
+            SVERSION, self.codec_id, SNORMALS if self.normals else 0,
+            self.keyframe_interval,
+            self.vertex_count if self.topology is not None else 0,
+            len(self.topology) if self.topology is not None else 0,
+            index_offset, len(self)))
+        self.f.close()
+
+
+class MeshSequence:
+    # random access to the frames of a mesh sequence. the last frame
+    # decoded is kept, so playing frames in order decodes each once.
+
+    def __init__(self, path, workers=None):
+        self.path = path
+        self.workers = workers
+        with open(path, 'rb') as f:
+            if f.read(len(SMAGIC)) != SMAGIC:
+                raise ValueError('`{}` is not a mesh sequence'.format(path))
+            header = f.read(SHEADER.size)
+            if len(header) != SHEADER.size:
+                raise ValueError('truncated mesh sequence')
+            version, codec_id, flags, self.keyframe_interval, \
+                self.vertex_count, self.triangle_count, index_offset, \
+                count = SHEADER.unpack(header)
+            if version != SVERSION:
+                raise ValueError('unsupported mesh sequence version {}'
+                                 .format(version))
+            self.decomp = get_decompressor(codec_id)
+            self.normals = bool(flags & SNORMALS)
+            f.seek(index_offset)
+            self.index = list(SENTRY.iter_unpack(
+                f.read(SENTRY.size * (count + 1))))
+            if len(self.index) != count + 1:
+                raise ValueError('truncated mesh sequence')
+        self.topology = None
+        self.current = None
+
+    def __len__(self):
+        return len(self.index) - 1
+
+    def read_blocks(self, entries):
+        with open(self.path, 'rb') as f:
+            def blocks():
+                for offset, size in entries:
+                    f.seek(offset)
+                    yield f.read(size)
+            yield from ordered_map(self.decomp, blocks(),
+                                   workers=self.workers)
+
+    def frame_bits(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError('frame {} out of range'.format(i))
+        shape = (self.vertex_count, 6 if self.normals else 3)
+        start = i - i % self.keyframe_interval
+        bits = None
+        if self.current is not None and start <= self.current[0] <= i:
+            start, bits = self.current
+            start += 1
+        for data in self.read_blocks(self.index[start + 1:i + 2]):
+            delta = unshuffle_bytes(data, shape)
+            bits = delta if bits is None else bits ^ delta
+        self.current = (i, bits)
+        return bits
+
+    def frame(self, i):
+        # frame i as a Mesh
+        if self.topology is None:
+            data, = self.read_blocks(self.index[:1])
+            self.topology = Mesh.loadb(data, copy=False)
+        bits = self.frame_bits(i).view(numpy.float32)
+        vertices = self.topology.vertices.copy()
+        vertices['pos'] = bits[:, :3]
+        if self.normals:
+            vertices['normal'] = bits[:, 3:]
+        return Mesh(vertices, self.topology.triangles, copy=False)
+
+    def write_frame(self, i, path):
+        # write frame i out as a plain .wo3, for Tungsten to render
+        mesh = self.frame(i)
+        with open(path, 'wb') as f:
+            mesh.dump(f)
+        return path
@@ -1,3 +1,5 @@
+import numpy
+
 from carbide.scene.json import Data, Enum, Tuple, TypedSerializable
 from carbide.scene.medium import Medium
 from carbide.scene.texture import Texture, DiskTexture
@@ -27,6 +29,59 @@ class ReconstructionFilter(Enum):
     LANCZOS = Enum.auto()
 
 
+def frustum_visible(transform, fov, resolution, lo, hi, margin=0.0):
+    # which world-space boxes, as (n, 3) corner arrays grown by margin,
+    # can be seen by a Tungsten pinhole: looking down +z of transform,
+    # with a horizontal fov in degrees and resolution (width, height).
+    # boxes near the frustum's edges may pass without being seen, never
+    # the other way around. unbounded boxes are always visible.
+    lo = numpy.asarray(lo, dtype=numpy.float64)
+    hi = numpy.asarray(hi, dtype=numpy.float64)
+    visible = numpy.ones(len(lo), dtype=bool)
+    if fov >= 180:
+        return visible
+    m = numpy.asarray(getattr(transform, 'm', transform), dtype=numpy.float64)
+    axes = m[:3, :3] / numpy.linalg.norm(m[:3, :3], axis=0)
+    width, height = resolution
+    tx = numpy.tan(numpy.radians(fov) / 2)
+    ty = tx * height / width
+    # inward normals of the near, left, right, bottom and top planes
+    normals = numpy.array([
+        [0, 0, 1],
+        [1, 0, tx],
+        [-1, 0, tx],
+        [0, 1, ty],
+        [0, -1, ty],
+    ], dtype=numpy.float64) @ axes.T
+    normals /= numpy.linalg.norm(normals, axis=1)[:, None]
+
+    finite = numpy.isfinite(lo).all(axis=1) & numpy.isfinite(hi).all(axis=1)
+    center = (lo[finite] + hi[finite]) / 2 - m[:3, 3]
+    extent = (hi[finite] - lo[finite]) / 2 + margin
+    # distance of each box's farthest corner along each normal
+    dist = center @ normals.T + extent @ numpy.abs(normals).T
+    visible[finite] = (dist >= 0).all(axis=1)
+    return visible
+
+
+def projected_size(transform, fov, resolution, lo, hi):
+    # rough size of world-space boxes in a pinhole image, in pixels
+    # across, from their bounding spheres. boxes reaching behind the
+    # camera are infinitely large.
+    lo = numpy.asarray(lo, dtype=numpy.float64)
+    hi = numpy.asarray(hi, dtype=numpy.float64)
+    m = numpy.asarray(getattr(transform, 'm', transform), dtype=numpy.float64)
+    forward = m[:3, 2] / numpy.linalg.norm(m[:3, 2])
+    radius = numpy.linalg.norm(hi - lo, axis=1) / 2
+    depth = ((lo + hi) / 2 - m[:3, 3]) @ forward
+    width, _ = resolution
+    tx = numpy.tan(numpy.radians(min(fov, 179.0)) / 2)
+    # depth * tx is half the image width in world units at that depth
+    with numpy.errstate(invalid='ignore'):
+        size = radius / (depth * tx) * width
+    return numpy.where(depth > radius, size, numpy.inf)
+
+
 class Camera(TypedSerializable, Transformable, Data):
     tonemap: Tonemap = Tonemap.GAMMA
     resolution: Resolution = Data.field(default_factory=Resolution)
@@ -34,11 +89,28 @@ class Camera(TypedSerializable, Transformable, Data):
     reconstruction_filter: ReconstructionFilter = ReconstructionFilter.DIRAC
     transform: Transform = Data.field(default_factory=Transform)
 
+    def visible(self, lo, hi, margin=0.0):
+        # see frustum_visible. cameras without a frustum see everything
+        return numpy.ones(len(lo), dtype=bool)
+
+    def screen_size(self, lo, hi):
+        # see projected_size. without a frustum, everything is big
+        return numpy.full(len(lo), numpy.inf)
+
 
 class PinholeCamera(Camera):
     type = 'pinhole'
     fov: float = 60.0
 
+    def visible(self, lo, hi, margin=0.0):
+        res = (self.resolution.width, self.resolution.height)
+        return frustum_visible(self.transform, self.fov, res, lo, hi,
+                               margin=margin)
+
+    def screen_size(self, lo, hi):
+        res = (self.resolution.width, self.resolution.height)
+        return projected_size(self.transform, self.fov, res, lo, hi)
+
 
 class ThinlensCamera(Camera):
     type = 'thinlens'
@@ -49,6 +121,16 @@ class ThinlensCamera(Camera):
     focus_pivot: str = ''
     aperture: Texture = Data.field(default_factory=DiskTexture)
 
+    def visible(self, lo, hi, margin=0.0):
+        # rays start anywhere on the aperture, not just at its center
+        res = (self.resolution.width, self.resolution.height)
+        return frustum_visible(self.transform, self.fov, res, lo, hi,
+                               margin=margin + self.aperture_size)
+
+    def screen_size(self, lo, hi):
+        res = (self.resolution.width, self.resolution.height)
+        return projected_size(self.transform, self.fov, res, lo, hi)
+
 
 class EquirectangularCamera(Camera):
     type = 'equirectangular'
@@ -1,6 +1,8 @@
+import collections
 import dataclasses
 import enum
 import json
+import re
 
 
 class Serializable:
@@ -68,15 +70,11 @@ class TypedSerializable(Serializable):
             del data['type']
             return super().structure(scene, data)
 
-        def all_subclasses(cls):
-            for subcls in cls.__subclasses__():
-                yield subcls
-                yield from all_subclasses(subcls)
-
-        for subcls in all_subclasses(cls):
-            if subcls.type == tag:
-                return subcls.structure(scene, data)
-        raise ValueError('unknown type `{}` for {}'.format(tag, cls.__name__))
+        subcls = type_registry.get((cls, tag))
+        if subcls is None:
+            raise ValueError('unknown type `{}` for {}'
+                             .format(tag, cls.__name__))
+        return subcls.structure(scene, data)
 
     def destructure(self, scene):
         if not self.type:
@@ -110,10 +108,36 @@ class Enum(Serializable, enum.Enum):
         return '{}.{}'.format(self.__class__.__name__, self.name)
 
 
+# (base class, type tag) -> the TypedSerializable subclass of base
+# using that tag, for TypedSerializable.structure. filled in by DataMeta.
+# tags only need to be unique within a family (textures and primitives
+# both have a `disk`), so TypedSerializable itself is not a base here.
+type_registry = {}
+
+
+def register_type(subcls):
+    keys = [(base, subcls.type) for base in subcls.__mro__[1:]
+            if base is not TypedSerializable and
+            issubclass(base, TypedSerializable)]
+    for key in keys:
+        old = type_registry.get(key)
+        # redefining the same class (say, re-running a script) is fine
+        if old is not None and (old.__module__, old.__qualname__) != \
+           (subcls.__module__, subcls.__qualname__):
+            raise RuntimeError('type `{}` for {} used by both {} and {}'
+                               .format(subcls.type, key[0].__name__,
+                                       old.__name__, subcls.__name__))
+    for key in keys:
+        type_registry[key] = subcls
+
+
 class DataMeta(type):
     def __new__(cls, name, bases, members):
-        self = super().__new__(cls, name, bases, members)
-        return dataclasses.dataclass(self)
+        self = dataclasses.dataclass(super().__new__(cls, name, bases,
+                                                     members))
+        if issubclass(self, TypedSerializable) and members.get('type'):
+            register_type(self)
+        return self
 
 
 class DataBase(metaclass=DataMeta):
@@ -144,35 +168,10 @@ class Data(Serializable, DataBase):
 
     @classmethod
     def structure(cls, scene, data):
-        if not isinstance(data, dict):
-            raise ValueError('bad value {!r} for {}'
-                             .format(data, cls.__name__))
-        kwargs = {}
-        for f in dataclasses.fields(cls):
-            if f.name not in data:
-                if f.default is dataclasses.MISSING and \
-                   f.default_factory is dataclasses.MISSING:
-                    raise ValueError('required field `{}` missing in {}'
-                                     .format(f.name, cls.__name__))
-                continue
-            kwargs[f.name] = structure(scene, f.type, data[f.name])
-            del data[f.name]
-        if data:
-            n = next(iter(data.keys()))
-            raise ValueError('unexpected field `{}` for {}'
-                             .format(n, cls.__name__))
-        return cls(**kwargs)
+        return compiled(cls).structure(scene, data)
 
     def destructure(self, scene):
-        ret = {}
-        for f in dataclasses.fields(self):
-            if f.default_factory is not dataclasses.MISSING and\
-               f.default_factory() == getattr(self, f.name):
-                continue
-            if getattr(self, f.name) == f.default:
-                continue
-            ret[f.name] = destructure(scene, getattr(self, f.name))
-        return ret
+        return compiled(self.__class__).destructure(self, scene)
 
 
 class Tuple(Serializable, DataBase):
@@ -182,27 +181,10 @@ class Tuple(Serializable, DataBase):
 
     @classmethod
     def structure(cls, scene, data):
-        if not isinstance(data, list):
-            raise ValueError('bad value {!r} for {}'
-                             .format(data, cls.__name__))
-        args = []
-        for f in dataclasses.fields(cls):
-            if len(data) == 0:
-                raise ValueError('field `{}` missing in {}'
-                                 .format(f.name, cls.__name__))
-                continue
-            args.append(structure(scene, f.type, data.pop(0)))
-        if data:
-            n = next(iter(data.keys()))
-            raise ValueError('unexpected extra fields for {}'
-                             .format(n, cls.__name__))
-        return cls(*args)
+        return compiled(cls).structure(scene, data)
 
     def destructure(self, scene):
-        ret = []
-        for f in dataclasses.fields(self):
-            ret.append(destructure(scene, getattr(self, f.name)))
-        return ret
+        return compiled(self.__class__).destructure(self, scene)
 
 
 def structure(scene, typ, value):
@@ -220,3 +202,209 @@ def destructure(scene, value):
         return value.destructure(scene)
     else:
         return value
+
+
+# for scanning JSON a value at a time, see scan_object
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+decoder = json.JSONDecoder()
+
+
+def skip_whitespace(text, pos):
+    return WHITESPACE.match(text, pos).end()
+
+
+def expect(text, pos, chars):
+    if pos >= len(text) or text[pos] not in chars:
+        raise ValueError('expected one of `{}` at {}'.format(chars, pos))
+    return text[pos]
+
+
+def scan_value(text, pos):
+    # (end, name) of the JSON value at pos, where name is its top-level
+    # "name" if it is an object with a string one. the decoded value is
+    # thrown away, it's only decoded to find where it ends.
+    value, end = decoder.raw_decode(text, pos)
+    name = value.get('name') if isinstance(value, dict) else None
+    return (end, name if isinstance(name, str) else None)
+
+
+def scan_array(text, pos):
+    # ([(start, end, name)] for each element, end) of the JSON array at
+    # pos. see scan_value.
+    expect(text, pos, '[')
+    pos = skip_whitespace(text, pos + 1)
+    entries = []
+    if text[pos:pos + 1] == ']':
+        return (entries, pos + 1)
+    while True:
+        end, name = scan_value(text, pos)
+        entries.append((pos, end, name))
+        pos = skip_whitespace(text, end)
+        if expect(text, pos, ',]') == ']':
+            return (entries, pos + 1)
+        pos = skip_whitespace(text, pos + 1)
+
+
+def scan_object(text, lazy_keys):
+    # decode the JSON object in text like json.loads, except the members
+    # named in lazy_keys, which must be arrays, and are left as the
+    # element spans scan_array finds
+    pos = skip_whitespace(text, 0)
+    expect(text, pos, '{')
+    pos = skip_whitespace(text, pos + 1)
+    data = {}
+    if text[pos:pos + 1] != '}':
+        while True:
+            expect(text, pos, '"')
+            key, pos = decoder.raw_decode(text, pos)
+            pos = skip_whitespace(text, pos)
+            expect(text, pos, ':')
+            pos = skip_whitespace(text, pos + 1)
+            if key in lazy_keys:
+                data[key], pos = scan_array(text, pos)
+            else:
+                data[key], pos = decoder.raw_decode(text, pos)
+            pos = skip_whitespace(text, pos)
+            if expect(text, pos, ',}') == '}':
+                break
+            pos = skip_whitespace(text, pos + 1)
+    if skip_whitespace(text, pos + 1) != len(text):
+        raise ValueError('extra data after JSON object at {}'.format(pos + 1))
+    return data
+
+
+# structure / destructure functions specialized to one Data or Tuple
+# class, generated on first use and cached on the class. they do what
+# the generic versions above would, with the field list, defaults and
+# field types looked up once instead of once per object.
+Compiled = collections.namedtuple('Compiled',
+                                  ['cls', 'structure', 'destructure'])
+
+
+def compiled(cls):
+    # subclasses see their parent's functions until they get their own
+    c = getattr(cls, '_compiled', None)
+    if c is None or c.cls is not cls:
+        if issubclass(cls, Tuple):
+            c = compile_tuple(cls)
+        else:
+            c = compile_data(cls)
+        cls._compiled = c
+    return c
+
+
+def compile_functions(cls, lines, env):
+    env.update({
+        'cls': cls,
+        'name': cls.__name__,
+        'Serializable': Serializable,
+        'structure': structure,
+    })
+    ns = {}
+    exec('\n'.join(lines), env, ns)
+    return Compiled(cls, ns['structure'], ns['destructure'])
+
+
+def compile_structure_value(i, typ, value, env):
+    # lines checking and converting value for a field of type typ,
+    # leaving the result in v
+    if isinstance(typ, type) and issubclass(typ, Serializable):
+        env['structure_{}'.format(i)] = typ.structure
+        return ['v = structure_{}(scene, {})'.format(i, value)]
+    if isinstance(typ, type):
+        env['type_{}'.format(i)] = typ
+        return [
+            'v = {}'.format(value),
+            'if not isinstance(v, type_{}):'.format(i),
+            '    raise ValueError(\'bad value {{!r}} for {{}}\''
+            '.format(v, type_{}.__name__))'.format(i),
+        ]
+    env['type_{}'.format(i)] = typ
+    return ['v = structure(scene, type_{}, {})'.format(i, value)]
+
+
+def compile_destructure_value(value):
+    return '{0}.destructure(scene) if isinstance({0}, Serializable) ' \
+        'else {0}'.format(value)
+
+
+def compile_data(cls):
+    env = {}
+    s = [
+        'def structure(scene, data):',
+        '    if not isinstance(data, dict):',
+        '        raise ValueError(\'bad value {!r} for {}\''
+        '.format(data, name))',
+        '    kwargs = {}',
+    ]
+    d = [
+        'def destructure(self, scene):',
+        '    ret = {}',
+    ]
+    for i, f in enumerate(dataclasses.fields(cls)):
+        s.append('    if {!r} in data:'.format(f.name))
+        s.extend('        ' + l for l in compile_structure_value(
+            i, f.type, 'data.pop({!r})'.format(f.name), env))
+        s.append('        kwargs[{!r}] = v'.format(f.name))
+        if f.default is dataclasses.MISSING and \
+           f.default_factory is dataclasses.MISSING:
+            s.append('    else:')
+            s.append('        raise ValueError({!r})'.format(
+                'required field `{}` missing in {}'.format(
+                    f.name, cls.__name__)))
+
+        # fields equal to their default are left out
+        d.append('    v = self.{}'.format(f.name))
+        indent = '    '
+        if f.default_factory is not dataclasses.MISSING:
+            # made once and only ever compared against, never handed out
+            env['default_{}'.format(i)] = f.default_factory()
+            d.append('    if not default_{} == v:'.format(i))
+            indent += '    '
+        elif f.default is not dataclasses.MISSING:
+            env['default_{}'.format(i)] = f.default
+            d.append('    if not v == default_{}:'.format(i))
+            indent += '    '
+        d.append(indent + 'ret[{!r}] = {}'.format(
+            f.name, compile_destructure_value('v')))
+    s.extend([
+        '    if data:',
+        '        raise ValueError(\'unexpected field `{}` for {}\''
+        '.format(next(iter(data)), name))',
+        '    return cls(**kwargs)',
+    ])
+    d.append('    return ret')
+    return compile_functions(cls, s + d, env)
+
+
+def compile_tuple(cls):
+    env = {}
+    fields = dataclasses.fields(cls)
+    s = [
+        'def structure(scene, data):',
+        '    if not isinstance(data, list):',
+        '        raise ValueError(\'bad value {!r} for {}\''
+        '.format(data, name))',
+    ]
+    d = [
+        'def destructure(self, scene):',
+    ]
+    for i, f in enumerate(fields):
+        s.append('    if len(data) <= {}:'.format(i))
+        s.append('        raise ValueError({!r})'.format(
+            'field `{}` missing in {}'.format(f.name, cls.__name__)))
+        s.extend('    ' + l for l in compile_structure_value(
+            i, f.type, 'data[{}]'.format(i), env))
+        s.append('    arg_{} = v'.format(i))
+        d.append('    v_{} = self.{}'.format(i, f.name))
+    s.extend([
+        '    if len(data) > {}:'.format(len(fields)),
+        '        raise ValueError(\'unexpected extra fields for {}\''
+        '.format(name))',
+        '    return cls({})'.format(
+            ', '.join('arg_{}'.format(i) for i in range(len(fields)))),
+    ])
+    d.append('    return [{}]'.format(', '.join(
+        compile_destructure_value('v_{}'.format(i))
+        for i in range(len(fields)))))
+    return compile_functions(cls, s + d, env)
@@ -1,7 +1,7 @@
 import abc
 import collections
 
-from carbide.scene.json import NamedSerializable, Serializable
+from carbide.scene.json import NamedSerializable, Serializable, decoder
 
 
 class ABCMetaGetItem(abc.ABCMeta):
@@ -42,3 +42,76 @@ class NamedCollection(Serializable, collections.UserList,
                 return v
         raise KeyError(
             'could not find {} named `{}`'.format(self.T.__name__, name))
+
+
+class LazyNamedCollection(NamedCollection):
+    # a NamedCollection loaded from JSON text, whose elements stay text
+    # until they are used. indexing, iterating, len() and find() (by
+    # the names found when scanning) structure only what they touch.
+    # anything else structures everything and becomes a plain
+    # NamedCollection, through data.
+    @classmethod
+    def from_source(cls, scene, source, entries):
+        # entries are (start, end, name) spans in source, see
+        # carbide.scene.json.scan_array
+        self = cls.__new__(cls)
+        self._scene = scene
+        self._source = source
+        self._starts = [start for start, _, _ in entries]
+        self._items = [None] * len(entries)
+        self._names = {}
+        for i, (_, _, name) in enumerate(entries):
+            if name:
+                self._names.setdefault(name, i)
+        return self
+
+    def __getattr__(self, name):
+        if name != 'data' or '_items' not in self.__dict__:
+            raise AttributeError(name)
+        self.data = [self.item(i) for i in range(len(self._items))]
+        del self._scene, self._source, self._starts, self._items, self._names
+        return self.data
+
+    def lazy(self):
+        return 'data' not in self.__dict__
+
+    def item(self, i):
+        if not self.lazy():
+            return self.data[i]
+        v = self._items[i]
+        if v is None:
+            v = decoder.raw_decode(self._source, self._starts[i])[0]
+            v = self._items[i] = self.T.structure_full(self._scene, v)
+        return v
+
+    def __len__(self):
+        if self.lazy():
+            return len(self._items)
+        return super().__len__()
+
+    def __getitem__(self, i):
+        if self.lazy() and not isinstance(i, slice):
+            return self.item(range(len(self._items))[i])
+        return super().__getitem__(i)
+
+    def __iter__(self):
+        if not self.lazy():
+            return iter(self.data)
+        return (self.item(i) for i in range(len(self._items)))
+
+    def __copy__(self):
+        if not self.lazy():
+            return super().__copy__()
+        # copies share elements, so share the structured ones too. any
+        # change to either materializes it into its own list first
+        inst = self.__class__.__new__(self.__class__)
+        inst.__dict__.update(self.__dict__)
+        return inst
+
+    def find(self, name):
+        if self.lazy():
+            i = self._names.get(name)
+            # unless it was renamed since
+            if i is not None and getattr(self.item(i), 'name', '') == name:
+                return self.item(i)
+        return super().find(name)
@@ -1,3 +1,10 @@
+import copy
+import os.path
+
+import numpy
+
+import carbide.curves
+import carbide.mesh
 from carbide.scene.bsdf import Bsdf, LambertBsdf
 from carbide.scene.json import Data, Enum, NamedSerializable, TypedSerializable
 from carbide.scene.medium import Medium
@@ -14,6 +21,15 @@ class Primitive(NamedSerializable, TypedSerializable, Transformable, Data):
     int_medium: Medium = None
     ext_medium: Medium = None
 
+    def local_bounds(self, input_directory=None):
+        # (min, max) corners before the transform, or None if unbounded
+        return None
+
+    def local_mesh(self, input_directory=None):
+        # a carbide.mesh.Mesh of the shape before the transform, or None
+        # for shapes a triangle mesh can't match
+        return None
+
 
 class Mesh(Primitive):
     type = 'mesh'
@@ -23,28 +39,100 @@ class Mesh(Primitive):
     recompute_normals: bool = False
     # FIXME this can be a list or 1 bsdf
     bsdf: Bsdf = Data.field(default_factory=LambertBsdf)
+    # lower resolution versions of file, as sorted [screen size, file]
+    # pairs. Tungsten doesn't know these, so Scene.with_lods swaps them
+    # in (and drops them) before rendering
+    lods: list = Data.field(default_factory=list)
+    # [min, max] corners of file, saved by add_lod so picking a level
+    # doesn't read the full resolution mesh
+    lod_bounds: list = None
+
+    def local_bounds(self, input_directory=None):
+        if self.lod_bounds is not None:
+            return tuple(numpy.array(c, dtype=numpy.float64)
+                         for c in self.lod_bounds)
+        if not self.file:
+            return None
+        return carbide.mesh.Mesh.open(
+            os.path.join(input_directory or '', self.file)).bounds()
+
+    def local_mesh(self, input_directory=None):
+        if not self.file:
+            return None
+        return carbide.mesh.Mesh.open(
+            os.path.join(input_directory or '', self.file))
+
+    def add_lod(self, file, screen_size, input_directory=None):
+        # use file instead when the mesh is at most screen_size pixels
+        # across. lods is replaced, not changed, so copies of this
+        # primitive keep their own levels
+        if self.lod_bounds is None:
+            bounds = self.local_bounds(input_directory=input_directory)
+            if bounds is not None:
+                self.lod_bounds = [c.tolist() for c in bounds]
+        self.lods = sorted(self.lods + [[screen_size, file]])
+        return self
+
+    def lod_file(self, screen_size):
+        # the coarsest file good enough at screen_size
+        for limit, file in self.lods:
+            if screen_size <= limit:
+                return file
+        return self.file
+
+    def at_lod(self, screen_size):
+        # a copy using lod_file(screen_size), with no more levels
+        mesh = copy.copy(self)
+        mesh.file = self.lod_file(screen_size)
+        mesh.lods = []
+        mesh.lod_bounds = None
+        return mesh
+
+
+# Tungsten's analytic shapes fit inside these before their transforms.
+# the unit ones are generous for some shapes, which is fine for culling
+HALF_UNIT_BOUNDS = (numpy.full(3, -0.5), numpy.full(3, 0.5))
+UNIT_BOUNDS = (numpy.full(3, -1.0), numpy.full(3, 1.0))
 
 
 class Cube(Primitive):
     type = 'cube'
     bsdf: Bsdf = Data.field(default_factory=LambertBsdf)
 
+    def local_bounds(self, input_directory=None):
+        return HALF_UNIT_BOUNDS
+
+    def local_mesh(self, input_directory=None):
+        return carbide.mesh.cube()
+
 
 class Sphere(Primitive):
     type = 'sphere'
     bsdf: Bsdf = Data.field(default_factory=LambertBsdf)
 
+    def local_bounds(self, input_directory=None):
+        return UNIT_BOUNDS
+
 
 class Quad(Primitive):
     type = 'quad'
     bsdf: Bsdf = Data.field(default_factory=LambertBsdf)
 
+    def local_bounds(self, input_directory=None):
+        return HALF_UNIT_BOUNDS
+
+    def local_mesh(self, input_directory=None):
+        return carbide.mesh.quad()
+
 
 class Disk(Primitive):
     type = 'disk'
     cone_angle: float = 90.0
     bsdf: Bsdf = Data.field(default_factory=LambertBsdf)
 
+    def local_bounds(self, input_directory=None):
+        return UNIT_BOUNDS
+
 
 class CurveMode(Enum):
     CYLINDER = Enum.auto()
@@ -62,10 +150,20 @@ class Curves(Primitive):
     subsample: float = 0.0
     curve_thickness: bool = False
 
+    def local_bounds(self, input_directory=None):
+        # only .hair files are carbide's to read
+        if not self.file.endswith('.hair'):
+            return None
+        with open(os.path.join(input_directory or '', self.file), 'rb') as f:
+            return carbide.curves.Curves.load(f).bounds()
+
 
 class Point(Primitive):
     type = 'point'
 
+    def local_bounds(self, input_directory=None):
+        return UNIT_BOUNDS
+
 
 class Skydome(Primitive):
     type = 'skydome'
@@ -81,6 +179,9 @@ class Cylinder(Primitive):
     capped: bool = True
     bsdf: Bsdf = Data.field(default_factory=LambertBsdf)
 
+    def local_bounds(self, input_directory=None):
+        return UNIT_BOUNDS
+
 
 # FIXME instances
 
@@ -98,3 +199,36 @@ class InfiniteSphereCap(Primitive):
 
 
 # FIXME minecraft_map
+
+
+def primitive_bounds(primitives, input_directory=None):
+    # world-space (min, max) corners of each primitive, as (n, 3) arrays.
+    # unbounded primitives get infinite boxes. mesh files shared between
+    # primitives are only read once.
+    primitives = list(primitives)
+    lo = numpy.full((len(primitives), 3), -numpy.inf)
+    hi = numpy.full((len(primitives), 3), numpy.inf)
+    files = {}
+    local = []
+    for i, p in enumerate(primitives):
+        key = (type(p), getattr(p, 'file', None))
+        if key not in files:
+            files[key] = p.local_bounds(input_directory=input_directory)
+        if files[key] is not None:
+            local.append((i, files[key]))
+    if not local:
+        return (lo, hi)
+
+    idx = numpy.array([i for i, _ in local])
+    llo = numpy.array([b[0] for _, b in local], dtype=numpy.float64)
+    lhi = numpy.array([b[1] for _, b in local], dtype=numpy.float64)
+    m = numpy.array([primitives[i].transform.m for i in idx],
+                    dtype=numpy.float64)
+    # transform the box centers, and the extents by |linear part|
+    center = (llo + lhi) / 2
+    extent = (lhi - llo) / 2
+    center = numpy.einsum('nij,nj->ni', m[:, :3, :3], center) + m[:, :3, 3]
+    extent = numpy.einsum('nij,nj->ni', numpy.abs(m[:, :3, :3]), extent)
+    lo[idx] = center - extent
+    hi[idx] = center + extent
+    return (lo, hi)
@@ -1,18 +1,37 @@
+import copy
+import itertools
+import json
 import os
+import os.path
 import tempfile
 import time
 
+import numpy
+
+import carbide.mesh
 from carbide.tungsten import Tungsten, TungstenFinished
 from carbide.scene.bsdf import Bsdf
 from carbide.scene.camera import Camera, PinholeCamera
-from carbide.scene.json import Data
+from carbide.scene.json import Data, destructure, scan_object
 from carbide.scene.integrator import Integrator, PathTracer
 from carbide.scene.medium import Medium
-from carbide.scene.namedcollection import NamedCollection
-from carbide.scene.primitive import Primitive
+from carbide.scene.namedcollection import (LazyNamedCollection,
+                                           NamedCollection)
+from carbide.scene.primitive import (Cube, Mesh, Primitive, Quad,
+                                    primitive_bounds)
+
+
+__all__ = ['Renderer', 'Scene', 'preview_cache']
 
+# how much disk preview_cache() may use
+PREVIEW_CACHE_SIZE = 4 << 30
 
-__all__ = ['Renderer', 'Scene']
+
+def preview_cache():
+    # where preview renders keep decimated meshes between runs
+    return carbide.mesh.MeshCache(
+        os.path.join(tempfile.gettempdir(), 'carbide-preview'),
+        max_size=PREVIEW_CACHE_SIZE)
 
 
 class Renderer(Data):
@@ -46,15 +65,44 @@ class Scene(Data):
     integrator: Integrator = Data.field(default_factory=PathTracer)
     renderer: Renderer = Data.field(default_factory=Renderer)
 
+    # fields that are NamedCollections, handled an element at a time
+    named_collections = ['media', 'bsdfs', 'primitives']
+
+    @classmethod
+    def load(cls, scene, f, lazy=False):
+        if lazy:
+            return cls.loads(scene, f.read(), lazy=True)
+        return super().load(scene, f)
+
+    @classmethod
+    def loads(cls, scene, data, lazy=False):
+        # with lazy, the named collections are LazyNamedCollections, and
+        # keep their elements as JSON text until they're used
+        if not lazy:
+            return super().loads(scene, data)
+        text = data
+        data = scan_object(text, cls.named_collections)
+        scene = cls()
+        for k in cls.named_collections:
+            if k in data:
+                T = type(getattr(scene, k)).T
+                setattr(scene, k, LazyNamedCollection[T].from_source(
+                    scene, text, data.pop(k)))
+        return cls.structure_settings(scene, data)
+
     @classmethod
     def structure(cls, scene, data):
         # named collections need special care
         scene = cls()
-        for k in ['media', 'bsdfs', 'primitives']:
+        for k in cls.named_collections:
             if k in data:
                 getattr(scene, k).structure_in_place(scene, data.get(k, []))
                 del data[k]
+        return cls.structure_settings(scene, data)
 
+    @classmethod
+    def structure_settings(cls, scene, data):
+        # everything but the named collections, into scene.
         # now re-use Data.structure
         cheating = super().structure(scene, data)
         # copy over attrs
@@ -67,17 +115,253 @@ class Scene(Data):
     def destructure(self, scene):
         return super().destructure(self)
 
+    def iterdump(self, indent=None, batch_size=256):
+        # the same JSON as dumps(), in pieces, without ever holding more
+        # than batch_size destructured collection elements
+        if indent is not None and not isinstance(indent, str):
+            indent = ' ' * indent
+        encoder = json.JSONEncoder(indent=indent)
+        separator = ', ' if indent is None else ','
+
+        def newline(level):
+            return '' if indent is None else '\n' + indent * level
+
+        def encode(value, level):
+            s = encoder.encode(value)
+            return s if indent is None else s.replace('\n', newline(level))
+
+        # named collections are destructured one element at a time, and
+        # everything else is small, so destructure it as usual
+        rest = copy.copy(self)
+        for k in self.named_collections:
+            setattr(rest, k, type(getattr(self, k))())
+        fields = super(Scene, rest).destructure(self)
+        keys = [k for k in self.named_collections if getattr(self, k)]
+        keys += list(fields)
+        if not keys:
+            yield '{}'
+            return
+
+        yield '{'
+        for i, k in enumerate(keys):
+            if i:
+                yield separator
+            yield newline(1) + encoder.encode(k) + ': '
+            if k in fields:
+                yield encode(fields[k], 1)
+                continue
+            # encoding elements in batches keeps the encoder's setup cost
+            # down. each batch is a list at this level, brackets removed
+            yield '['
+            elements = iter(getattr(self, k))
+            for j in itertools.count():
+                batch = [v.destructure_full(self)
+                         for v in itertools.islice(elements, batch_size)]
+                if not batch:
+                    break
+                if j:
+                    yield separator
+                yield encode(batch, 1)[1:-len(newline(1) + ']')]
+            yield newline(1) + ']'
+        yield newline(0) + '}'
+
+    def dump(self, scene, f, indent=None, buffer_size=1 << 16):
+        # writes iterdump() to f about buffer_size characters at a time
+        buf = []
+        size = 0
+        for s in self.iterdump(indent=indent):
+            buf.append(s)
+            size += len(s)
+            if size >= buffer_size:
+                f.write(''.join(buf))
+                buf.clear()
+                size = 0
+        f.write(''.join(buf))
+
+    def with_primitives(self, primitives):
+        # a shallow copy of this scene with a different primitive list
+        scene = copy.copy(self)
+        scene.primitives = type(self.primitives)(primitives)
+        return scene
+
+    def map_meshes(self, fn, directory, prefix, input_directory=None,
+                   select=None, cache=None):
+        # a copy of this scene where each mesh primitive (for which
+        # select(primitive) is true) points at fn(mesh), written into
+        # directory. returns the copy and the rewritten primitives.
+        # with a carbide.mesh.MeshCache, results go there instead, under
+        # prefix, and are reused for meshes seen before.
+        if input_directory is None:
+            input_directory = os.getcwd()
+        files = {}
+        primitives = []
+        changed = []
+        for p in self.primitives:
+            if isinstance(p, Mesh) and p.file and (select is None or
+                                                   select(p)):
+                src = os.path.join(input_directory, p.file)
+                if src not in files:
+                    with open(src, 'rb') as f:
+                        mesh = carbide.mesh.Mesh.load(f)
+                    if cache is not None:
+                        files[src] = cache.derive(mesh, prefix, fn)
+                    else:
+                        dst = os.path.join(directory, '{}{}_{}'.format(
+                            prefix, len(files), os.path.basename(p.file)))
+                        with open(dst, 'wb') as f:
+                            fn(mesh).dump(f)
+                        files[src] = os.path.abspath(dst)
+                p = copy.copy(p)
+                p.file = files[src]
+                changed.append(p)
+            primitives.append(p)
+        return (self.with_primitives(primitives), changed)
+
+    def decimated(self, ratio, directory, input_directory=None, cache=None):
+        # a copy of this scene with every mesh swapped for a version
+        # with about ratio of the triangles, written into directory, or
+        # kept in cache (see map_meshes) so each mesh is decimated once
+        scene, _ = self.map_meshes(lambda m: m.decimate(ratio), directory,
+                                   'decimated{}'.format(ratio),
+                                   input_directory=input_directory,
+                                   cache=cache)
+        return scene
+
+    def with_normals(self, directory, mode='area', crease_angle=27.0,
+                     input_directory=None):
+        # a copy of this scene where meshes that ask Tungsten to
+        # recompute normals have them computed once, into directory.
+        # Tungsten splits its normals at 0.15 pi (27 degrees), so that
+        # is the default crease_angle. None smooths across every edge
+        scene, changed = self.map_meshes(
+            lambda m: m.compute_normals(mode=mode, crease_angle=crease_angle),
+            directory, 'normals', input_directory=input_directory,
+            select=lambda p: p.recompute_normals)
+        for p in changed:
+            p.recompute_normals = False
+        return scene
+
+    def merged(self, directory, input_directory=None):
+        # a copy of this scene where static meshes and flat shapes (no
+        # emission or media) with the same bsdf and flags are baked into
+        # one mesh each, written into directory
+        if input_directory is None:
+            input_directory = os.getcwd()
+        pivot = getattr(self.camera, 'focus_pivot', '')
+        groups = {}
+        for i, p in enumerate(self.primitives):
+            if not isinstance(p, (Mesh, Cube, Quad)) or \
+               (isinstance(p, Mesh) and not p.file) or \
+               p.emission is not None or p.power is not None or \
+               p.int_medium is not None or p.ext_medium is not None or \
+               (pivot and p.name == pivot):
+                continue
+            # shapes have the flags of a default Mesh
+            key = (json.dumps(destructure(self, p.bsdf), sort_keys=True),
+                   getattr(p, 'smooth', False),
+                   getattr(p, 'backface_culling', False),
+                   getattr(p, 'recompute_normals', False))
+            groups.setdefault(key, []).append(i)
+
+        primitives = list(self.primitives)
+        for n, (key, members) in enumerate(
+                (k, g) for k, g in groups.items() if len(g) > 1):
+            prims = [primitives[i] for i in members]
+            meshes = {}
+            keys = [(type(p), getattr(p, 'file', None)) for p in prims]
+            for p, k in zip(prims, keys):
+                if k not in meshes:
+                    meshes[k] = p.local_mesh(input_directory=input_directory)
+            mesh = carbide.mesh.merge([meshes[k] for k in keys],
+                                      [p.transform for p in prims])
+            fname = os.path.abspath(
+                os.path.join(directory, 'merged{}.wo3'.format(n)))
+            with open(fname, 'wb') as f:
+                mesh.dump(f)
+
+            _, smooth, backface_culling, recompute_normals = key
+            primitives[members[0]] = Mesh(
+                name='merged{}'.format(n), file=fname, bsdf=prims[0].bsdf,
+                smooth=smooth, backface_culling=backface_culling,
+                recompute_normals=recompute_normals)
+            for i in members[1:]:
+                primitives[i] = None
+
+        return self.with_primitives(p for p in primitives if p is not None)
+
+    def culled(self, margin=0.1, directory=None, demote_ratio=None,
+               input_directory=None):
+        # a copy of this scene without the primitives the camera cannot
+        # see. boxes are grown by margin times the size of the scene
+        # first, to keep things that cast shadows or light into view.
+        # emitters, media, unbounded primitives and the focus pivot are
+        # always kept. with demote_ratio, meshes kept only because of
+        # the margin are decimated to that ratio, into directory.
+        if demote_ratio is not None and directory is None:
+            raise ValueError('demoting meshes needs a directory')
+        lo, hi = primitive_bounds(self.primitives,
+                                  input_directory=input_directory)
+        finite = numpy.isfinite(lo).all(axis=1) & \
+            numpy.isfinite(hi).all(axis=1)
+        if not finite.any():
+            return self.with_primitives(self.primitives)
+        size = numpy.linalg.norm(hi[finite].max(axis=0) -
+                                 lo[finite].min(axis=0))
+        keep = self.camera.visible(lo, hi, margin=margin * size)
+        seen = self.camera.visible(lo, hi)
+
+        pivot = getattr(self.camera, 'focus_pivot', '')
+        for i, p in enumerate(self.primitives):
+            if p.emission is not None or p.power is not None or \
+               p.int_medium is not None or p.ext_medium is not None or \
+               (pivot and p.name == pivot):
+                keep[i] = seen[i] = True
+
+        scene = self.with_primitives(
+            p for p, k in zip(self.primitives, keep) if k)
+        if demote_ratio is not None:
+            demote = {id(p) for p, k, s in zip(self.primitives, keep, seen)
+                      if k and not s}
+            scene, _ = scene.map_meshes(
+                lambda m: m.decimate(demote_ratio), directory, 'demoted',
+                input_directory=input_directory,
+                select=lambda p: id(p) in demote)
+        return scene
+
+    def with_lods(self, input_directory=None):
+        # a copy of this scene where every mesh with levels of detail
+        # (see Mesh.add_lod) uses the one that suits its size on screen
+        prims = [p for p in self.primitives
+                 if isinstance(p, Mesh) and p.lods]
+        if not prims:
+            return self.with_primitives(self.primitives)
+        lo, hi = primitive_bounds(prims, input_directory=input_directory)
+        sizes = self.camera.screen_size(lo, hi)
+        chosen = {id(p): p.at_lod(size) for p, size in zip(prims, sizes)}
+        return self.with_primitives(chosen.get(id(p), p)
+                                    for p in self.primitives)
+
     def save(self, fname):
         with open(fname, 'w') as f:
             self.dump(self, f)
 
-    def render(self, output, update=None, **kwargs):
+    def render(self, output, update=None, preview_ratio=None,
+               mesh_cache=None, **kwargs):
+        # preview_ratio renders with decimated meshes, see decimated(),
+        # kept in mesh_cache (by default, preview_cache()) between renders
         # FIXME if this scene was loaded from a file,
         # this should probably the directory it is in
         input_directory = os.getcwd()
         with tempfile.TemporaryDirectory(prefix='carbide.') as tmp:
+            scene = self.with_lods(input_directory=input_directory)
+            if preview_ratio is not None:
+                if mesh_cache is None:
+                    mesh_cache = preview_cache()
+                scene = scene.decimated(preview_ratio, tmp,
+                                        input_directory=input_directory,
+                                        cache=mesh_cache)
             scene_name = os.path.join(tmp, 'scene.json')
-            self.save(scene_name)
+            scene.save(scene_name)
 
             renderer = Tungsten(scene_name, output_directory=tmp,
                                 input_directory=input_directory, **kwargs)
@@ -37,7 +37,9 @@ class Transform(Serializable, Transformable):
         return 'Transform({!r})'.format(self.m)
 
     def __eq__(self, other):
-        return numpy.all(self.m == Transform(other).m)
+        if isinstance(other, Transform):
+            other = other.m
+        return bool((self.m == numpy.asarray(other)).all())
 
     @classmethod
     def structure(cls, scene, data):